@@ -0,0 +1,113 @@
+"""Suballocation of shared GL buffers."""
+
+import bisect
+import OpenGL
+
+OpenGL.ERROR_CHECKING = False
+from OpenGL.GL import *
+
+
+class BufferArena:
+    """A growable GL buffer handed out in ranges of fixed size units.
+
+    Freed ranges go on a free list and are coalesced with their
+    neighbours, allocations take the first free range that fits before
+    appending at the end. When the buffer is full it doubles, copying the
+    old contents on the GPU with glCopyBufferSubData, so buffer_id changes
+    and anything that references the buffer must be rebound. The arena only
+    binds to the copy targets, so it never disturbs VAO bindings.
+    """
+
+    def __init__(self, unit_size, capacity=1024):
+        """Create arena of capacity units of unit_size bytes each."""
+        self.unit_size = unit_size
+        self.capacity = capacity
+        self.end = 0
+        # sorted, non-adjacent [offset, count] ranges below end
+        self.free_ranges = []
+        self.buffer_id = int(glGenBuffers(1))
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.buffer_id)
+        glBufferData(GL_COPY_WRITE_BUFFER, capacity * unit_size, None, GL_STATIC_DRAW)
+
+    def delete(self):
+        """Delete the buffer."""
+        glDeleteBuffers(1, [self.buffer_id])
+        self.buffer_id = 0
+
+    def _grow(self, capacity):
+        """Move the contents into a new buffer of capacity units."""
+        new_id = int(glGenBuffers(1))
+        glBindBuffer(GL_COPY_WRITE_BUFFER, new_id)
+        glBufferData(
+            GL_COPY_WRITE_BUFFER, capacity * self.unit_size, None, GL_STATIC_DRAW
+        )
+        glBindBuffer(GL_COPY_READ_BUFFER, self.buffer_id)
+        glCopyBufferSubData(
+            GL_COPY_READ_BUFFER,
+            GL_COPY_WRITE_BUFFER,
+            0,
+            0,
+            self.end * self.unit_size,
+        )
+        glDeleteBuffers(1, [self.buffer_id])
+        self.buffer_id = new_id
+        self.capacity = capacity
+
+    def alloc(self, count, align=1):
+        """Reserve count units starting at a multiple of align, returns the offset.
+
+        An empty allocation reserves nothing and leaves the free list alone.
+        """
+        if not count:
+            return 0
+        for i, (offset, size) in enumerate(self.free_ranges):
+            start = offset + (-offset % align)
+            if start + count > offset + size:
+                continue
+            # keep what is left on either side of the allocation free
+            rest = [
+                [offset, start - offset],
+                [start + count, offset + size - start - count],
+            ]
+            self.free_ranges[i : i + 1] = [r for r in rest if r[1]]
+            return start
+        start = self.end + (-self.end % align)
+        if start + count > self.capacity:
+            self._grow(max(start + count, self.capacity * 2))
+        if start > self.end:
+            self.free_ranges.append([self.end, start - self.end])
+        self.end = start + count
+        return start
+
+    def free(self, offset, count):
+        """Return a range to the arena."""
+        if not count:
+            return
+        i = bisect.bisect(self.free_ranges, [offset, count])
+        self.free_ranges.insert(i, [offset, count])
+        # merge with the next range, then the previous one
+        if i + 1 < len(self.free_ranges):
+            next_offset, next_count = self.free_ranges[i + 1]
+            if offset + count == next_offset:
+                self.free_ranges[i][1] += next_count
+                del self.free_ranges[i + 1]
+        if i > 0:
+            prev_offset, prev_count = self.free_ranges[i - 1]
+            if prev_offset + prev_count == offset:
+                self.free_ranges[i - 1][1] += self.free_ranges[i][1]
+                del self.free_ranges[i]
+                i -= 1
+        # a free range at the end just moves the end back
+        last_offset, last_count = self.free_ranges[-1]
+        if last_offset + last_count == self.end:
+            self.end = last_offset
+            del self.free_ranges[-1]
+
+    def upload(self, offset, data):
+        """Write data at unit offset."""
+        if not data.nbytes:
+            return
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.buffer_id)
+        glBufferSubData(
+            GL_COPY_WRITE_BUFFER, offset * self.unit_size, data.nbytes, data
+        )
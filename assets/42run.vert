@@ -4,8 +4,14 @@ layout (location = 0) in vec2 vert_uv;
 layout (location = 1) in vec3 vert_norm;
 layout (location = 2) in vec3 vert_pos;
 
-uniform mat4 MVP;
-uniform mat4 MV;
+layout (std140) uniform Camera
+{
+	mat4 V;
+	mat4 P;
+	mat4 VP;
+};
+
+uniform mat4 M;
 
 out vec2 uv;
 out vec3 norm;
@@ -13,8 +19,10 @@ out	vec3 camera_dir;
 
 void	main()
 {
-	gl_Position = MVP * vec4(vert_pos, 1.0);
+	mat4 MV = V * M;
+	vec4 view_pos = MV * vec4(vert_pos, 1.0);
+	gl_Position = P * view_pos;
 	uv = vert_uv;
 	norm = vec3(MV * vec4(vert_norm, 0.0));
-	camera_dir = vec3(0.0, 0.0, 0.0) - (MV * vec4(vert_pos, 1.0)).xyz;
+	camera_dir = vec3(0.0, 0.0, 0.0) - view_pos.xyz;
 }
\ No newline at end of file
@@ -0,0 +1,27 @@
+#version 410 core
+
+layout (location = 0) in vec2 vert_uv;
+layout (location = 1) in vec3 vert_norm;
+layout (location = 2) in vec3 vert_pos;
+layout (location = 3) in mat4 M;
+
+layout (std140) uniform Camera
+{
+	mat4 V;
+	mat4 P;
+	mat4 VP;
+};
+
+out vec2 uv;
+out vec3 norm;
+out	vec3 camera_dir;
+
+void	main()
+{
+	mat4 MV = V * M;
+	vec4 view_pos = MV * vec4(vert_pos, 1.0);
+	gl_Position = P * view_pos;
+	uv = vert_uv;
+	norm = vec3(MV * vec4(vert_norm, 0.0));
+	camera_dir = vec3(0.0, 0.0, 0.0) - view_pos.xyz;
+}
\ No newline at end of file
@@ -2,13 +2,20 @@
 
 layout (location = 2) in vec3 pos;
 
-uniform mat4 MVP;
+layout (std140) uniform Camera
+{
+    mat4 V;
+    mat4 P;
+    mat4 VP;
+};
+
+uniform mat4 M;
 
 out vec3 uvw;
 
 void main()
 {
-    vec4 transformed_pos = MVP * vec4(pos, 1.0);
+    vec4 transformed_pos = VP * M * vec4(pos, 1.0);
     gl_Position = transformed_pos.xyww;
     uvw = pos;
 } 
\ No newline at end of file
@@ -7,8 +7,9 @@ in vec2 uv;
 out vec4 color;
 
 uniform sampler2D tex;
+uniform vec4 tint;
 
 void	main()
 {
-	color = texture(tex, uv).rgba;
+	color = texture(tex, uv).rgba * tint;
 }
\ No newline at end of file
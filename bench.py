@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Replay a seeded run offscreen and record frame times to CSV."""
+
+import offscreen
+import argparse
+import random
+import numpy as np
+from context import Context
+from loader import AssetLoader
+from main import game
+from collector import FrameCollector
+from profiling import FrameProfiler
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="42run rendering benchmark")
+    parser.add_argument("--frames", type=int, default=600, help="frames to render")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--width", type=int, default=1024, help="frame width")
+    parser.add_argument("--height", type=int, default=1024, help="frame height")
+    parser.add_argument("--out", default="bench.csv", help="CSV output path")
+    parser.add_argument(
+        "--compress-textures",
+        action="store_true",
+        help="bake textures into a GPU compressed format",
+    )
+    parser.add_argument(
+        "--pack-vertices",
+        action="store_true",
+        help="store models in a packed 16 byte vertex format",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    """main."""
+    args = parse_args()
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    window = offscreen.OffscreenWindow(args.width, args.height, args.frames, args.seed)
+    ctx = Context(args.compress_textures, args.pack_vertices)
+    loader = AssetLoader(ctx)
+    loader.load_models(["marvin", "skybox", "table", "plane", "mac"])
+    loader.load_texture_cubemap("assets/skybox")
+    # compile shaders while the workers decode
+    ctx.create_program("42run")
+    ctx.create_program("text")
+    loader.finish()
+    collector = FrameCollector()
+    recorder = FrameProfiler(
+        ["simulate", "render", "swap"], ctx, args.frames, collector=collector
+    )
+    game(window, ctx, recorder, collector=collector)
+    recorder.close()
+    ctx.release()
+    window.close()
+    recorder.write_csv(args.out)
+    print(f"{len(recorder.rows)} frames written to {args.out}")
+    print(recorder.dump())
+    print(recorder.report())
+    print(collector.report())
@@ -1,6 +1,7 @@
 """Camera."""
 from pyrr import matrix44
 import numpy as np
+from culling import frustum_planes
 
 
 class Camera:
@@ -12,10 +13,14 @@ class Camera:
         target=np.array([0.0, 0.0, 1.0], dtype=np.float32),
         aspect=1.0,
         fov=60.0,
+        near=0.1,
+        far=300.0,
     ):
-        """Create camera."""
+        """Create camera, nothing past far is drawn."""
         self.fov = fov
         self.aspect = aspect
+        self.near = near
+        self.far = far
         if isinstance(pos, np.ndarray):
             self.pos = pos
         else:
@@ -31,10 +36,10 @@ class Camera:
             np.array([0, 1, 0]),  # up vector
         )
         self.regen_view = False
-        self.P = matrix44.create_perspective_projection(
-            self.fov, aspect, 0.1, 300, dtype=np.float32
-        )
-        self.regen_prespective = False
+        self._regen_prespective()
+        # V, P and VP laid out like the std140 Camera uniform block
+        self.block = np.zeros((3, 4, 4), dtype=np.float32)
+        self.planes = None
 
     def set_aspect(self, aspect):
         """Set camera aspect ratio."""
@@ -48,7 +53,7 @@ class Camera:
 
     def set_pos(self, pos):
         """Set camera position."""
-        self.pos = pos
+        self.pos = np.array(pos, dtype=np.float32)
         self.regen_view = True
 
     def set_target(self, target):
@@ -58,9 +63,10 @@ class Camera:
 
     def _regen_prespective(self):
         self.P = matrix44.create_perspective_projection(
-            self.fov, self.aspect, 0.1, 100, dtype=np.float32
+            self.fov, self.aspect, self.near, self.far, dtype=np.float32
         )
         self.regen_prespective = False
+        self.planes = None
 
     def _regen_view(self):
         self.V = matrix44.create_look_at(
@@ -69,13 +75,28 @@ class Camera:
             np.array([0, 1, 0]),  # up vector
         )
         self.regen_view = False
+        self.planes = None
 
-    def gen_uniforms(self, M):
-        """Generate standard camera uniforms."""
+    def _regen(self):
         if self.regen_prespective:
             self._regen_prespective()
         if self.regen_view:
             self._regen_view()
-        MV = matrix44.multiply(M, self.V)
-        MVP = matrix44.multiply(MV, self.P)
-        return {"M": M, "V": self.V, "MV": MV, "MVP": MVP}
+
+    def gen_camera_block(self):
+        """Generate the Camera uniform block shared by every program.
+
+        The returned array is reused by the next call.
+        """
+        self._regen()
+        self.block[0] = self.V
+        self.block[1] = self.P
+        np.matmul(self.V, self.P, out=self.block[2])
+        return self.block
+
+    def frustum(self):
+        """World space frustum planes, see culling.frustum_planes."""
+        self._regen()
+        if self.planes is None:
+            self.planes = frustum_planes(np.matmul(self.V, self.P))
+        return self.planes
@@ -0,0 +1,33 @@
+"""Fixed timestep clock."""
+
+
+class FixedStep:
+    """Splits wall clock time into fixed simulation steps.
+
+    Leftover time is carried to the next frame and exposed as alpha, the
+    fraction of a step to interpolate render state by. After a long stall
+    at most max_steps steps are run and the rest of the backlog is dropped,
+    so a slow frame can not snowball into slower ones.
+    """
+
+    def __init__(self, rate=120.0, max_steps=8, now=0.0):
+        """Create clock."""
+        self.step = 1.0 / rate
+        self.max_steps = max_steps
+        self.last_time = now
+        self.accumulator = 0.0
+        self.alpha = 0.0
+        self.time = 0.0
+
+    def tick(self, now):
+        """Advance to wall time now, return the number of steps to simulate."""
+        self.accumulator += max(now - self.last_time, 0.0)
+        self.last_time = now
+        steps = int(self.accumulator / self.step)
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator = steps * self.step
+        self.accumulator -= steps * self.step
+        self.time += steps * self.step
+        self.alpha = max(self.accumulator / self.step, 0.0)
+        return steps
@@ -0,0 +1,102 @@
+"""Garbage collection kept out of frames."""
+
+import gc
+import time
+
+
+class FrameCollector:
+    """Runs the cyclic garbage collector at frame ends instead of mid frame.
+
+    While started, automatic collection is off. begin_frame() starts the
+    frame clock once the previous swap returned, end_frame() counts the
+    objects the frame allocated that the collector tracks and that are
+    still alive, then collects them as the young generation. That
+    collection only scans what the frame left behind, so it is cheap.
+    Older generations are collected as often as the default thresholds
+    would collect them. The exception is full collections, which cause
+    the hitches: they wait for a frame that ends with full_budget seconds
+    of frame_time to spare, and are only forced once max_deferred of them
+    are overdue. freeze() moves everything loaded so far out of reach of
+    every collection until stop().
+    """
+
+    def __init__(self, frame_time=1.0 / 60.0, full_budget=0.004, max_deferred=10):
+        """Create collector for frames of frame_time seconds."""
+        self.frame_time = frame_time
+        self.full_budget = full_budget
+        self.max_deferred = max_deferred
+        self.thresholds = gc.get_threshold()
+        self.was_enabled = gc.isenabled()
+        self.frozen = False
+        self.frame_start = time.perf_counter()
+        self.allocations = 0
+        self.frames = 0
+        self.total_allocations = 0
+        self.peak_allocations = 0
+        self.collections = [0, 0, 0]
+
+    def freeze(self):
+        """Collect, then exempt every surviving object from later collections.
+
+        Call once loading is done, the assets and long lived game state are
+        never garbage but a full collection would scan them all.
+        """
+        gc.collect()
+        gc.freeze()
+        self.frozen = True
+
+    def start(self):
+        """Turn automatic collection off, end_frame() collects instead."""
+        self.was_enabled = gc.isenabled()
+        gc.disable()
+        self.begin_frame()
+
+    def stop(self):
+        """Unfreeze and hand collection back to the interpreter.
+
+        Frozen objects become collectable again, so whatever the game
+        dropped is reclaimed once it returns.
+        """
+        if self.frozen:
+            gc.unfreeze()
+            self.frozen = False
+        if self.was_enabled:
+            gc.enable()
+
+    def begin_frame(self):
+        """Mark the start of a frame, call after the previous swap.
+
+        The time the swap waited for vsync is not frame work, counting it
+        would leave no spare time for full collections.
+        """
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Count and collect what the frame left behind.
+
+        Call before swapping buffers, a collection there runs in time the
+        swap would otherwise spend waiting.
+        """
+        self.allocations, young, old = gc.get_count()
+        self.frames += 1
+        self.total_allocations += self.allocations
+        self.peak_allocations = max(self.peak_allocations, self.allocations)
+        spare = self.frame_time - (time.perf_counter() - self.frame_start)
+        overdue = old - self.thresholds[2]
+        if overdue >= 0 and (spare >= self.full_budget or overdue >= self.max_deferred):
+            generation = 2
+        elif young >= self.thresholds[1]:
+            generation = 1
+        else:
+            generation = 0
+        if self.allocations or generation:
+            gc.collect(generation)
+            self.collections[generation] += 1
+
+    def report(self):
+        """Format allocations per frame and collections per generation."""
+        mean = self.total_allocations / max(self.frames, 1)
+        return (
+            f"{mean:.1f} allocations/frame, peak {self.peak_allocations},"
+            + " collections {} young {} old {} full".format(*self.collections)
+        )
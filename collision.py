@@ -0,0 +1,57 @@
+"""Collision queries along the run axis."""
+
+import numpy as np
+
+
+class CollisionIndex:
+    """Sorted index of objects that scroll along z with the track.
+
+    Everything on the track moves at the same speed, so objects are stored
+    by their track-space z (world z plus distance scrolled). Their order
+    never changes after insertion and a z window query is two binary
+    searches plus a max over the objects inside it.
+    """
+
+    def __init__(self, width=3):
+        """Create index, width is the number of values per object."""
+        self.scroll = 0.0
+        self.z = np.empty(0, dtype=np.float64)
+        self.values = np.empty((0, width), dtype=np.int8)
+
+    def __len__(self):
+        """Number of indexed objects."""
+        return len(self.z)
+
+    def advance(self, distance):
+        """Scroll every indexed object towards -z by distance."""
+        self.scroll += distance
+
+    def insert(self, z, value):
+        """Index an object currently at world z."""
+        track_z = z + self.scroll
+        i = np.searchsorted(self.z, track_z, side="right")
+        self.z = np.insert(self.z, i, track_z)
+        self.values = np.insert(self.values, i, value, axis=0)
+
+    def prune(self, z_min):
+        """Drop every object whose world z is below z_min."""
+        i = np.searchsorted(self.z, z_min + self.scroll, side="left")
+        if i:
+            self.z = self.z[i:]
+            self.values = self.values[i:]
+
+    def query(self, z_min, z_max):
+        """Element-wise max of the values of objects with z_min < z < z_max."""
+        lo = np.searchsorted(self.z, z_min + self.scroll, side="right")
+        hi = np.searchsorted(self.z, z_max + self.scroll, side="left")
+        return self.values[lo:hi].max(axis=0, initial=0)
+
+    def query_many(self, centers, half_width):
+        """Query one open z window per center, returns (N, width) values."""
+        track = np.asarray(centers, dtype=np.float64) + self.scroll
+        lo = np.searchsorted(self.z, track - half_width, side="right")
+        hi = np.searchsorted(self.z, track + half_width, side="left")
+        hits = np.zeros((len(track), self.values.shape[1]), dtype=self.values.dtype)
+        for i in np.flatnonzero(hi > lo):
+            hits[i] = self.values[lo[i] : hi[i]].max(axis=0)
+        return hits
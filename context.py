@@ -4,8 +4,12 @@ import ctypes
 import numpy as np
 import glob
 import os.path
-from PIL import Image
-from pywavefront import Wavefront
+from allocator import BufferArena
+from mesh import load_mesh
+import shadercache
+from streaming import RingBuffer, TextureStreamer
+import texcache
+import vertexformat
 import OpenGL
 
 OpenGL.ERROR_CHECKING = False
@@ -14,24 +18,81 @@ from OpenGL.GL import shaders
 from OpenGL.raw.GL.EXT.texture_filter_anisotropic import *
 
 
-class Model:
-    """Holds information about a model to be rendered."""
+INDEX_TYPES = {
+    np.dtype(np.uint16): GL_UNSIGNED_SHORT,
+    np.dtype(np.uint32): GL_UNSIGNED_INT,
+}
 
-    def __init__(self, offset, indices, texture):
-        """Create model."""
+
+class Model:
+    """Holds information about a model to be rendered.
+
+    offset and indices are the first index and index count of the model in
+    the element buffer of its VAO, base_vertex is added to every index and
+    is the first of its vertices in the vertex buffer. textures are every
+    texture the model holds a reference to. bounds_min and bounds_max are
+    its model space AABB, radius bounds it around the model origin under
+    any rotation. lods holds the index count and pointer of every level of
+    detail, finest first. Its vertices store positions divided by
+    position_scale, the model matrix it is drawn with has to undo that.
+    fallback models are float32 in the fallback arrays of their VAO.
+    """
+
+    def __init__(
+        self,
+        offset,
+        indices,
+        texture,
+        base_vertex=0,
+        index_dtype=np.uint32,
+        vertices=0,
+        textures=(),
+        positions=None,
+        lods=None,
+        position_scale=1.0,
+        fallback=False,
+    ):
+        """Create model, its bounds are computed from (N,3) positions."""
         self.offset = offset
         self.indices = indices
         self.texture = texture
+        self.base_vertex = base_vertex
+        self.vertices = vertices
+        self.textures = list(textures)
+        self.position_scale = position_scale
+        self.fallback = fallback
+        self.index_dtype = np.dtype(index_dtype)
+        self.index_type = INDEX_TYPES[self.index_dtype]
+        self.index_ptr = ctypes.c_void_p(offset * self.index_dtype.itemsize)
+        self.lods = [
+            (count, ctypes.c_void_p((offset + first) * self.index_dtype.itemsize))
+            for first, count in lods or [(0, indices)]
+        ]
+        if positions is None or not len(positions):
+            positions = np.zeros((1, 3), dtype=np.float32)
+        self.bounds_min = positions.min(axis=0)
+        self.bounds_max = positions.max(axis=0)
+        self.radius = float(np.sqrt((positions * positions).sum(axis=1).max()))
 
 
 class VAO:
-    """Holds ids that are managed by a VAO."""
+    """Holds ids that are managed by a VAO.
+
+    Models share vertex_arena and index_arena, created on the first load,
+    their vertices are stored in vertex_format. Models that lose too much
+    precision in a lossy vertex_format are stored as float32 in fallback, a
+    VAO made on demand that shares index_arena. Other buffers in buffer_ids
+    are deleted with the VAO.
+    """
 
-    def __init__(self):
+    def __init__(self, vertex_format=vertexformat.FLOAT):
         """Create model."""
-        self.id = glGenVertexArrays(1)
+        self.id = int(glGenVertexArrays(1))
+        self.vertex_format = vertex_format
         self.buffer_ids = []
-        self.texture_ids = []
+        self.vertex_arena = None
+        self.index_arena = None
+        self.fallback = None
 
 
 class Uniform:
@@ -44,8 +105,36 @@ class Uniform:
         self.size = size
 
 
+class UniformBlock:
+    """Uniform block index, binding point and std140 size in bytes."""
+
+    def __init__(self, index, binding, size):
+        """Create model."""
+        self.index = index
+        self.binding = binding
+        self.size = size
+
+
+UNIFORM_SETTERS = {
+    GL_FLOAT_MAT4: lambda loc, v: glUniformMatrix4fv(loc, 1, GL_FALSE, v),
+    GL_FLOAT_VEC4: lambda loc, v: glUniform4fv(loc, 1, v),
+    GL_FLOAT_VEC3: lambda loc, v: glUniform3fv(loc, 1, v),
+    GL_FLOAT: lambda loc, v: glUniform1f(loc, v),
+    GL_INT: lambda loc, v: glUniform1i(loc, v),
+    GL_SAMPLER_2D: lambda loc, v: glUniform1i(loc, v),
+    GL_SAMPLER_CUBE: lambda loc, v: glUniform1i(loc, v),
+}
+
+
 class Context:
-    """Context."""
+    """Context.
+
+    Keeps a shadow copy of the GL state it changes, so redundant state
+    changes are skipped without querying GL. calls_issued and calls_avoided
+    count how many state changes reached GL and how many were skipped.
+    draw_calls and bytes_uploaded count draws and the buffer, uniform and
+    texture data sent to GL.
+    """
 
     GL_CUBE_MAP_FACES = [
         GL_TEXTURE_CUBE_MAP_POSITIVE_X,
@@ -56,65 +145,292 @@ class Context:
         GL_TEXTURE_CUBE_MAP_NEGATIVE_Z,
     ]
 
-    def __init__(self):
-        """Create render context."""
+    def __init__(self, compress_textures=False, pack_vertices=False):
+        """Create render context.
+
+        compress_textures bakes loaded textures into a GPU compressed format
+        when the driver can encode one. It cuts VRAM use by 4x but software
+        rasterizers decode compressed texels slowly, so it is opt in.
+        pack_vertices stores models in the packed vertex format instead of
+        float32, half the size. Models it would lose precision in are kept
+        as float32, with a warning.
+        """
+        self.compress_textures = compress_textures
+        self.vertex_format = (
+            vertexformat.packed_format() if pack_vertices else vertexformat.FLOAT
+        )
         self.program_ids = {}
         self.active_program = None
         self.uniforms = {}
+        self.uniform_values = {}
+        self.uniform_blocks = {}
+        # uniform block name to binding point and buffer, shared by programs
+        self.block_bindings = {}
+        self.uniform_buffers = {}
+        self.state = {}
+        self.calls_issued = 0
+        self.calls_avoided = 0
+        self.draw_calls = 0
+        self.bytes_uploaded = 0
         self.models = {}
         self.textures = {}
+        # texture id to the number of models using it
+        self.texture_refs = {}
         # create vao
         self.vertex_arrays = {}
         self.active_vertex_array = None
         self.create_vao("default")
         self.use_vao("default")
         glClearColor(0.0, 0.0, 0.0, 1.0)
-        glEnable(GL_DEPTH_TEST)
-        glDepthFunc(GL_LESS)
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        self.enable(GL_DEPTH_TEST)
+        self.depth_func(GL_LESS)
+        self.enable(GL_BLEND)
+        self.blend_func(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        # numpy rows are tightly packed
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        self.texture_streamer = None
+        self.ring = None
+
+    def release(self):
+        """Delete the GL objects the context made for itself.
+
+        Call before the window and its GL context are destroyed.
+        """
+        if self.texture_streamer is not None:
+            self.texture_streamer.release()
+            self.texture_streamer = None
+        if self.ring is not None:
+            self.ring.release()
+            self.ring = None
 
     def clear(self):
         """Clear buffer."""
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-    def create_program(self, name):
-        """Load shaders."""
+    def dynamic_buffer(self):
+        """Ring buffer for vertex and instance data rewritten every frame."""
+        if self.ring is None:
+            self.ring = RingBuffer()
+        return self.ring
+
+    def begin_frame(self):
+        """Start writing a new frame of dynamic data."""
+        if self.ring is not None:
+            self.ring.begin_frame()
+
+    def end_frame(self):
+        """Mark the dynamic data of the frame as submitted."""
+        if self.ring is not None:
+            self.bytes_uploaded += self.ring.cursor - self.ring.start
+            self.ring.end_frame()
+
+    def _set_state(self, key, value):
+        """Record a state value, return False if GL already has it."""
+        if key in self.state and self.state[key] == value:
+            self.calls_avoided += 1
+            return False
+        self.state[key] = value
+        self.calls_issued += 1
+        return True
+
+    def reset_stats(self):
+        """Zero the state change, draw and upload counters."""
+        self.calls_issued = 0
+        self.calls_avoided = 0
+        self.draw_calls = 0
+        self.bytes_uploaded = 0
+
+    def enable(self, cap):
+        """glEnable if cap is not already enabled."""
+        if self._set_state(("enabled", cap), True):
+            glEnable(cap)
+
+    def disable(self, cap):
+        """glDisable if cap is not already disabled."""
+        if self._set_state(("enabled", cap), False):
+            glDisable(cap)
+
+    def depth_func(self, func):
+        """Set the depth function, return the previous one."""
+        old = self.state.get(("depth_func",), GL_LESS)
+        if self._set_state(("depth_func",), func):
+            glDepthFunc(func)
+        return old
+
+    def cull_face(self, mode):
+        """Set the culled face, return the previous one."""
+        old = self.state.get(("cull_face",), GL_BACK)
+        if self._set_state(("cull_face",), mode):
+            glCullFace(mode)
+        return old
+
+    def blend_func(self, src, dst):
+        """Set the blend function."""
+        if self._set_state(("blend_func",), (src, dst)):
+            glBlendFunc(src, dst)
+
+    def bind_texture(self, target, texture_id, unit=0):
+        """Bind a texture to a texture unit."""
+        if self._set_state(("active_texture",), unit):
+            glActiveTexture(GL_TEXTURE0 + unit)
+        if self._set_state(("texture", unit, target), texture_id):
+            glBindTexture(target, texture_id or 0)
+
+    def delete_textures(self, texture_ids):
+        """Delete textures and forget every binding or path that used them."""
+        texture_ids = [t for t in texture_ids if t]
+        if not texture_ids:
+            return
+        glDeleteTextures(texture_ids)
+        for key in [k for k, v in self.state.items() if k[0] == "texture"]:
+            if self.state[key] in texture_ids:
+                del self.state[key]
+        for textures in self.textures.values():
+            for path in [p for p, t in textures.items() if t in texture_ids]:
+                del textures[path]
+        for texture_id in texture_ids:
+            self.texture_refs.pop(texture_id, None)
+
+    def acquire_texture(self, texture_id):
+        """Take a reference to a texture."""
+        self.texture_refs[texture_id] = self.texture_refs.get(texture_id, 0) + 1
+
+    def release_texture(self, texture_id):
+        """Drop a reference to a texture, deleting it with the last one."""
+        if texture_id not in self.texture_refs:
+            return
+        self.texture_refs[texture_id] -= 1
+        if not self.texture_refs[texture_id]:
+            self.delete_textures([texture_id])
+
+    def create_program(self, name, vert_name=None, frag_name=None):
+        """Load shaders.
+
+        Shader sources default to assets/{name}.vert and assets/{name}.frag,
+        vert_name and frag_name let programs share a stage. Linked programs
+        are cached as driver binaries, see shadercache.
+        """
         if name in self.program_ids:
             return
         try:
-            with open(os.path.join("assets", name + ".frag"), "r") as src:
+            with open(os.path.join("assets", (frag_name or name) + ".frag")) as src:
                 frag_src = src.read()
-            with open(os.path.join("assets", name + ".vert"), "r") as src:
+            with open(os.path.join("assets", (vert_name or name) + ".vert")) as src:
                 vert_src = src.read()
         except Exception as e:
             exit("Error reading shader from disk")
-        # compile shaders and program
+        program_hash = None
+        cached = None
+        if shadercache.supported():
+            program_hash = shadercache.source_hash(vert_src, frag_src)
+            cached = shadercache.read_program(name, program_hash)
+        if cached:
+            program_id, reflection = cached
+        else:
+            program_id = self._link_program(vert_src, frag_src)
+            reflection = self._reflect_program(program_id)
+            if program_hash:
+                shadercache.write_program(name, program_hash, program_id, reflection)
+        self.program_ids[name] = program_id
+        self.uniforms[name] = {
+            uni_name: Uniform(*uni) for uni_name, uni in reflection["uniforms"].items()
+        }
+        self.uniform_values[name] = {}
+        self.uniform_blocks[name] = {}
+        # bind every uniform block to the binding point of its name
+        for block_name, (index, size) in reflection["blocks"].items():
+            binding = self.block_bindings.setdefault(
+                block_name, len(self.block_bindings)
+            )
+            glUniformBlockBinding(program_id, index, binding)
+            self.uniform_blocks[name][block_name] = UniformBlock(index, binding, size)
+
+    def _link_program(self, vert_src, frag_src):
+        """Compile and link a program that allows reading back its binary."""
         try:
             frag_shader = shaders.compileShader(frag_src, GL_FRAGMENT_SHADER)
             vert_shader = shaders.compileShader(vert_src, GL_VERTEX_SHADER)
-            program_id = shaders.compileProgram(vert_shader, frag_shader)
         except RuntimeError as e:
             print(str(e).replace("\\n", "\n").replace("\\", ""))
             exit("Shaders failed to compile")
-        self.program_ids[name] = program_id
-        self.uniforms[name] = {}
-        # map uniform names to uniform ids
+        program_id = glCreateProgram()
+        glAttachShader(program_id, vert_shader)
+        glAttachShader(program_id, frag_shader)
+        glProgramParameteri(program_id, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        glLinkProgram(program_id)
+        glDetachShader(program_id, vert_shader)
+        glDetachShader(program_id, frag_shader)
+        glDeleteShader(vert_shader)
+        glDeleteShader(frag_shader)
+        if glGetProgramiv(program_id, GL_LINK_STATUS) != GL_TRUE:
+            print(glGetProgramInfoLog(program_id).decode("utf-8"))
+            exit("Shaders failed to link")
+        return program_id
+
+    def _reflect_program(self, program_id):
+        """Map uniform names to (id, type, size), blocks to (index, size)."""
+        uniforms = {}
+        blocks = {}
+        # block members have no location and are set through their block
         num_uniforms = glGetProgramiv(program_id, GL_ACTIVE_UNIFORMS)
         for i in range(0, num_uniforms):
             uni_name, uni_size, uni_type = glGetActiveUniform(program_id, i)
             uni_name = uni_name.decode("utf-8")
             uni_id = glGetUniformLocation(program_id, uni_name)
-            self.uniforms[name][uni_name] = Uniform(uni_id, uni_type, uni_size)
+            if uni_id == -1:
+                continue
+            uniforms[uni_name] = [int(uni_id), int(uni_type), int(uni_size)]
+        num_blocks = glGetProgramiv(program_id, GL_ACTIVE_UNIFORM_BLOCKS)
+        param = np.zeros(1, dtype=np.int32)
+        for i in range(0, num_blocks):
+            glGetActiveUniformBlockiv(
+                program_id, i, GL_UNIFORM_BLOCK_NAME_LENGTH, param
+            )
+            block_name = ctypes.create_string_buffer(int(param[0]))
+            glGetActiveUniformBlockName(program_id, i, int(param[0]), None, block_name)
+            block_name = block_name.value.decode("utf-8")
+            glGetActiveUniformBlockiv(program_id, i, GL_UNIFORM_BLOCK_DATA_SIZE, param)
+            blocks[block_name] = [i, int(param[0])]
+        return {"uniforms": uniforms, "blocks": blocks}
+
+    def update_uniform_block(self, block_name, data):
+        """Upload data to the buffer bound to a uniform block.
+
+        The buffer is shared by every program using a block of that name,
+        data must already be laid out std140.
+        """
+        binding = self.block_bindings.setdefault(block_name, len(self.block_bindings))
+        if block_name not in self.uniform_buffers:
+            buffer_id = glGenBuffers(1)
+            glBindBuffer(GL_UNIFORM_BUFFER, buffer_id)
+            glBufferData(GL_UNIFORM_BUFFER, data.nbytes, None, GL_DYNAMIC_DRAW)
+            glBindBufferBase(GL_UNIFORM_BUFFER, binding, buffer_id)
+            self.uniform_buffers[block_name] = (buffer_id, data.copy())
+        else:
+            buffer_id, last = self.uniform_buffers[block_name]
+            if np.array_equal(last, data):
+                self.calls_avoided += 1
+                return
+            np.copyto(last, data)
+            glBindBuffer(GL_UNIFORM_BUFFER, buffer_id)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, data.nbytes, data)
+        self.calls_issued += 1
+        self.bytes_uploaded += data.nbytes
 
     def update_uniforms(self, new_uniforms):
-        """Send matrixes to the GPU."""
-        CAMERA_UNIFORMS = set(["MVP", "MV", "V", "M", "P"])
+        """Send uniforms that changed since their last upload to the GPU."""
         active_uniforms = self.uniforms[self.active_program]
-        for uni in new_uniforms:
-            if uni in CAMERA_UNIFORMS and uni not in active_uniforms:
+        values = self.uniform_values[self.active_program]
+        for uni, value in new_uniforms.items():
+            last = values.get(uni)
+            if last is not None and np.array_equal(last, value):
+                self.calls_avoided += 1
                 continue
-            glUniformMatrix4fv(active_uniforms[uni].id, 1, GL_FALSE, new_uniforms[uni])
+            values[uni] = np.array(value, copy=True)
+            uniform = active_uniforms[uni]
+            UNIFORM_SETTERS[uniform.type](uniform.id, value)
+            self.calls_issued += 1
+            self.bytes_uploaded += values[uni].nbytes
 
     def uniform(self, name):
         """Get the uniform with name from the currently active program."""
@@ -125,100 +441,203 @@ class Context:
         if self.active_program != name:
             glUseProgram(self.program_ids[name])
             self.active_program = name
+            self.calls_issued += 1
+        else:
+            self.calls_avoided += 1
+
+    def create_vao(self, name, vertex_format=None):
+        """Create a new vertex array object.
 
-    def create_vao(self, name):
-        """Create a new vertex array object."""
+        Models loaded into it are stored in vertex_format, the format of
+        the context if None.
+        """
         if name in self.vertex_arrays:
             raise RuntimeError("VAO with that name already exists")
-        self.vertex_arrays[name] = VAO()
+        self.vertex_arrays[name] = VAO(vertex_format or self.vertex_format)
         self.models.setdefault(name, {})
         self.textures.setdefault(name, {})
 
-    def use_vao(self, name):
+    def delete_vao(self, name):
+        """Delete a vertex array object with its buffers and textures."""
+        self.unload_models(vao=name)
+        vao = self.vertex_arrays.pop(name)
+        if vao.buffer_ids:
+            glDeleteBuffers(len(vao.buffer_ids), vao.buffer_ids)
+        ids = [vao.id]
+        arenas = [vao.vertex_arena, vao.index_arena]
+        if vao.fallback is not None:
+            ids.append(vao.fallback.id)
+            arenas.append(vao.fallback.vertex_arena)
+        for arena in arenas:
+            if arena is not None:
+                arena.delete()
+        glDeleteVertexArrays(len(ids), ids)
+        self.models.pop(name, None)
+        self.textures.pop(name, None)
+        if self.active_vertex_array == name:
+            self.active_vertex_array = None
+        if self.state.get(("vertex_array",)) in ids:
+            del self.state[("vertex_array",)]
+
+    def use_vao(self, name, model=None):
         """Make vao active.
 
         Following calling this, all calls to load_{x} functions will use the
-        specified vao.
+        specified vao. Pass the model about to be drawn, fallback models are
+        drawn from the fallback arrays of the vao.
+        """
+        arrays = self.vertex_arrays[name]
+        if model is not None and model.fallback:
+            arrays = arrays.fallback
+        self.active_vertex_array = name
+        self._bind_vertex_array(arrays)
+
+    def _bind_vertex_array(self, arrays):
+        """Bind the GL vertex array of a VAO if it is not bound already."""
+        if self._set_state(("vertex_array",), arrays.id):
+            glBindVertexArray(arrays.id)
+
+    def _fallback_arrays(self, arrays):
+        """Float32 arrays for the models arrays cannot store, made on demand."""
+        if arrays.fallback is None:
+            arrays.fallback = VAO(vertexformat.FLOAT)
+            arrays.fallback.vertex_arena = BufferArena(vertexformat.FLOAT.stride)
+            arrays.fallback.index_arena = arrays.index_arena
+        return arrays.fallback
+
+    def unload_models(self, names=None, vao="default"):
+        """Free the buffer ranges and textures of models in a vao, all if None.
+
+        Other models in the vao stay loaded.
         """
-        if self.active_vertex_array != name:
-            glBindVertexArray(self.vertex_arrays[name].id)
-            self.active_vertex_array = name
-
-    def load_models(self, names, vao="default"):
-        """Load or reload models into a vao."""
-        glBindVertexArray(self.vertex_arrays[vao].id)
-        while self.vertex_arrays[vao].buffer_ids:
-            buff_id = self.vertex_arrays[vao].buffer_ids.pop()
-            glDeleteBuffers(buff_id, 1)
-        while self.vertex_arrays[vao].texture_ids:
-            tex_id = self.vertex_arrays[vao].texture_ids.pop()
-            glDeleteTextures(tex_id)
-
-        all_vertices = []
-        model_offset = 0
-        models = {}
-        for model_name in names:
-            model_indices = 0
-            obj = Wavefront(f"assets/{model_name}.obj", parse=True)
-            for name, mat in obj.materials.items():
-                if mat.vertex_format != "T2F_N3F_V3F":
-                    exit(
-                        f"Error in {model_name}.obj"
-                        + " vertex format must be T2F_N3F_V3F"
-                    )
-                texture = self.load_texture(mat.texture.path) if mat.texture else None
+        models = self.models[vao]
+        arrays = self.vertex_arrays[vao]
+        for name in list(models) if names is None else names:
+            model = models.pop(name, None)
+            if model is None:
+                continue
+            vertex_arena = (arrays.fallback if model.fallback else arrays).vertex_arena
+            vertex_arena.free(model.base_vertex, model.vertices)
+            size = model.index_dtype.itemsize
+            # the levels of detail tile the index range of the model
+            indices = sum(count for count, _ in model.lods)
+            arrays.index_arena.free(model.offset * size, indices * size)
+            for texture_id in model.textures:
+                self.release_texture(texture_id)
+
+    def load_models(self, names, vao="default", meshes=None):
+        """Load models into a vao, skipping the ones already in it.
+
+        Models are suballocated from buffers shared by the vao, so loading
+        never touches the models already loaded. To reload a model unload it
+        first. meshes are the already loaded meshes of names, see loader.
+        """
+        models = self.models[vao]
+        if meshes is None:
+            names = [name for name in names if name not in models]
+            meshes = [load_mesh(name) for name in names]
+        arrays = self.vertex_arrays[vao]
+        vertex_format = arrays.vertex_format
+        if arrays.vertex_arena is None:
+            # sized for the first load, later loads grow them
+            arrays.vertex_arena = BufferArena(
+                vertex_format.stride,
+                max(sum(len(mesh.vertices) for mesh in meshes), 1024),
+            )
+            arrays.index_arena = BufferArena(
+                1, max(sum(mesh.indices.nbytes for mesh in meshes), 4096)
+            )
+        for model_name, mesh in zip(names, meshes):
+            if model_name in models:
+                continue
+            texture = None
+            textures = []
+            for mat in mesh.materials:
+                texture = self.load_texture(mat.texture, vao) if mat.texture else None
                 if texture:
-                    self.vertex_arrays[vao].texture_ids.append(texture)
-                verts = np.array(mat.vertices, dtype=np.float32)
-                all_vertices.append(verts)
-                model_indices += len(mat.vertices) // 8
-            models[model_name] = Model(model_offset, model_indices, texture)
-            model_offset += model_indices
-
-        vertices = np.concatenate(all_vertices).ravel()
-
-        # upload to GPU
-        new_vbo = glGenBuffers(1)
-        self.vertex_arrays[vao].buffer_ids.append(new_vbo)
-        glBindBuffer(GL_ARRAY_BUFFER, new_vbo)
-        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
-
-        s = np.dtype(np.float32).itemsize * (2 + 3 + 3)
-        glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 2, GL_FLOAT, GL_FALSE, s, ctypes.c_void_p(0))
-
-        glEnableVertexAttribArray(1)
-        glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, s, ctypes.c_void_p(8))
-
-        glEnableVertexAttribArray(2)
-        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, s, ctypes.c_void_p(20))
-        self.models[vao] = models
-
-    def get_model(self, name):
-        """Get the model with name from the currently bound VAO."""
-        return self.models[self.active_vertex_array][name]
-
-    def load_texture(self, path, vao="default"):
-        """Upload a texture to GPU."""
+                    self.acquire_texture(texture)
+                    textures.append(texture)
+            # cached meshes are memory-mapped so float32 uploads stream
+            # straight from the page cache
+            vertices, position_scale = vertex_format.encode(mesh.vertices)
+            fallback = vertex_format.lossy and not vertex_format.validate(
+                model_name, mesh.vertices, vertices, position_scale
+            )
+            vertex_arena = arrays.vertex_arena
+            if fallback:
+                print(f"Warning: model {model_name} is kept as float32")
+                vertex_arena = self._fallback_arrays(arrays).vertex_arena
+                vertices, position_scale = vertexformat.FLOAT.encode(mesh.vertices)
+            base_vertex = vertex_arena.alloc(len(mesh.vertices))
+            vertex_arena.upload(base_vertex, vertices)
+            # index types are per model, ranges are aligned to their size
+            size = mesh.indices.dtype.itemsize
+            index_offset = arrays.index_arena.alloc(mesh.indices.nbytes, size)
+            arrays.index_arena.upload(index_offset, mesh.indices)
+            self.bytes_uploaded += vertices.nbytes + mesh.indices.nbytes
+            models[model_name] = Model(
+                index_offset // size,
+                mesh.lods[0][1],
+                texture,
+                base_vertex,
+                mesh.indices.dtype,
+                len(mesh.vertices),
+                textures,
+                mesh.vertices[:, 5:8],
+                mesh.lods,
+                position_scale,
+                fallback,
+            )
+
+        # growing moves the arenas to new buffers, point the vao at them
+        for bound in (arrays.fallback, arrays):
+            if bound is None:
+                continue
+            self._bind_vertex_array(bound)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, arrays.index_arena.buffer_id)
+            glBindBuffer(GL_ARRAY_BUFFER, bound.vertex_arena.buffer_id)
+            bound.vertex_format.bind()
+        self.use_vao(vao)
+
+    def get_model(self, name, vao=None):
+        """Get the model with name from vao, the currently bound VAO if None."""
+        return self.models[vao or self.active_vertex_array][name]
+
+    def texture_format(self, alpha=True):
+        """Internal format loaded textures are baked to."""
+        if self.compress_textures:
+            internal_format = texcache.compressed_format(alpha)
+            if internal_format:
+                return internal_format
+        return GL_RGBA8 if alpha else GL_RGB8
+
+    def load_texture(self, path, vao="default", chains=None):
+        """Upload a texture to GPU, chains are its decoded mip levels if given."""
         if path in self.textures[vao]:
             return self.textures[vao][path]
+        self.use_vao(vao)
+        texture_id = int(glGenTextures(1))
+        self.bind_texture(GL_TEXTURE_2D, texture_id)
+        internal_format = self.texture_format()
         try:
-            im = Image.open(path).convert("RGBA")
+            levels = texcache.load(
+                GL_TEXTURE_2D, [path], path, internal_format, chains=chains
+            )
         except Exception as e:
             exit("Error reading texture: " + path)
-        glBindVertexArray(self.vertex_arrays[vao].id)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, levels - 1)
+        self._texture_parameters()
+        self.textures[vao][path] = texture_id
+        return texture_id
+
+    def create_texture(self, im):
+        """Upload an RGBA PIL image as a mipmapped texture."""
         data = im.tobytes("raw", "RGBA", 0, -1)
 
         # generate a new texture id
-        texture_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, texture_id)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
-
-        max_af = min(glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT), 16.0)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, max_af)
+        texture_id = int(glGenTextures(1))
+        self.bind_texture(GL_TEXTURE_2D, texture_id)
+        self._texture_parameters()
         # upload texture
         glTexImage2D(
             GL_TEXTURE_2D,
@@ -232,37 +651,72 @@ class Context:
             data,
         )
         glGenerateMipmap(GL_TEXTURE_2D)
-        self.textures[vao][path] = texture_id
         return texture_id
 
-    def load_texture_cubemap(self, path, vao="default"):
-        """Load cubemap texture."""
-        # Generate a new texture id
-        if path in self.textures[vao]:
-            return self.textures[vao][path]
-        glBindVertexArray(self.vertex_arrays[vao].id)
-        texture_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_CUBE_MAP, texture_id)
+    def stream_texture(
+        self, texture_id, pixels, x=0, y=0, level=0, target=GL_TEXTURE_2D, mipmap=False
+    ):
+        """Update part of a texture from (H,W,C) pixels without stalling.
+
+        The copy goes through a fenced ring of pixel buffers, see
+        streaming.TextureStreamer. mipmap regenerates the levels below.
+        """
+        if self.texture_streamer is None:
+            self.texture_streamer = TextureStreamer()
+        self.bind_texture(target, texture_id)
+        self.texture_streamer.upload(target, pixels, x, y, level)
+        self.bytes_uploaded += np.asarray(pixels).nbytes
+        if mipmap:
+            glGenerateMipmap(target)
+
+    def _texture_parameters(self):
+        """Set filtering and wrapping of the bound mipmapped 2D texture."""
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+
+        max_af = min(glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT), 16.0)
+        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, max_af)
 
-        i = 0
+    def cubemap_faces(self, path):
+        """Paths of the six face images of the cubemap in directory path."""
         sides = ["right", "left", "top", "bottom", "front", "back"]
-        for face in self.GL_CUBE_MAP_FACES:
+        face_paths = []
+        for side in sides:
             try:
-                face_path = None
-                face_path = glob.glob(os.path.join(path, sides[i] + ".*"))[0]
-                im = Image.open(face_path).convert("RGBA")
-            except Exception as e:
+                face_paths.append(glob.glob(os.path.join(path, side + ".*"))[0])
+            except IndexError:
                 exit(
-                    "Error reading cubemap texture: "
-                    + (face_path if face_path else str(i) + ".*")
+                    "Error reading cubemap texture: " + os.path.join(path, side + ".*")
                 )
-            i += 1
-            data = im.tobytes("raw", "RGBA", 0, -1)
-            # Upload a texture
-            glTexImage2D(
-                face, 0, GL_RGB, im.width, im.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, data
+        return face_paths
+
+    def load_texture_cubemap(self, path, vao="default", chains=None):
+        """Load cubemap texture, chains are its decoded faces if given."""
+        # Generate a new texture id
+        if path in self.textures[vao]:
+            return self.textures[vao][path]
+        self.use_vao(vao)
+        texture_id = int(glGenTextures(1))
+        self.bind_texture(GL_TEXTURE_CUBE_MAP, texture_id)
+        # the skybox is opaque, like the GL_RGB it used to be uploaded as
+        internal_format = self.texture_format(alpha=False)
+        try:
+            levels = texcache.load(
+                GL_TEXTURE_CUBE_MAP,
+                self.cubemap_faces(path),
+                path,
+                internal_format,
+                self.GL_CUBE_MAP_FACES,
+                chains,
             )
-        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        except Exception as e:
+            exit("Error reading cubemap texture: " + path)
+        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAX_LEVEL, levels - 1)
+        glTexParameteri(
+            GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR
+        )
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
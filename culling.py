@@ -0,0 +1,23 @@
+"""View frustum culling."""
+
+import numpy as np
+
+
+def frustum_planes(VP):
+    """Extract the world space planes of a row vector view projection matrix.
+
+    Returns (6,4) planes, left, bottom, near, right, top then far. Each is
+    normalized so that dot(plane[:3], p) + plane[3] is the signed distance
+    of p to it, positive inside the frustum.
+    """
+    # clip = p . VP, so clip coordinate i is p dotted with column i
+    columns = np.transpose(VP)
+    planes = np.concatenate([columns[3] + columns[:3], columns[3] - columns[:3]])
+    planes /= np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+    return planes
+
+
+def visible_spheres(planes, centers, radii):
+    """Mask of the (N,3) centers whose spheres are at least partly inside."""
+    distances = np.matmul(centers, planes[:, :3].T) + planes[:, 3]
+    return np.all(distances >= -np.reshape(radii, (-1, 1)), axis=1)
@@ -1,9 +1,12 @@
 """Entity."""
 
-from pyrr import matrix44
 import numpy as np
 import OpenGL
 from typing import List
+from culling import visible_spheres
+from lod import lod_distances, select_lods
+from transform import model_matrices
+from renderqueue import OPAQUE, view_depth
 
 OpenGL.ERROR_CHECKING = False
 from OpenGL.GL import *
@@ -12,30 +15,79 @@ from OpenGL.GL import *
 class Drawable:
     """Drawable."""
 
+    __slots__ = (
+        "model",
+        "pos",
+        "rot",
+        "prev_pos",
+        "render_pos",
+        "transform",
+        "alive",
+        "lod",
+    )
+
     def __init__(self, model, pos=[0, 0, 0], rot=[0, 0, 0]):
         """Create entity."""
         self.model = model
         self.pos = np.array(pos, dtype=np.float32)
         self.rot = np.array(rot, dtype=np.float32)
-        self.transform = None
+        self.prev_pos = self.pos.copy()
+        self.render_pos = self.pos.copy()
+        self.transform = np.identity(4, dtype=np.float32)
         self.alive = True
-
-    def _update_transform(self):
-        self.transform = matrix44.multiply(
-            matrix44.create_from_eulers(self.rot, dtype=np.float32),
-            matrix44.create_from_translation(self.pos, dtype=np.float32),
+        self.lod = 0
+
+    def save_state(self):
+        """Remember the current position to interpolate renders from."""
+        np.copyto(self.prev_pos, self.pos)
+
+    def interpolate(self, alpha):
+        """Position alpha of the way from the saved to the current state."""
+        if alpha == 1.0:
+            return self.pos
+        np.subtract(self.pos, self.prev_pos, out=self.render_pos)
+        self.render_pos *= alpha
+        self.render_pos += self.prev_pos
+        return self.render_pos
+
+    def _update_transform(self, alpha=1.0):
+        model_matrices(
+            self.interpolate(alpha)[np.newaxis],
+            self.rot[np.newaxis],
+            self.transform[np.newaxis],
         )
 
-    def draw(self, ctx, camera):
-        """Draw da thing."""
+    def draw(self, queue, camera, alpha=1.0):
+        """Queue da thing, alpha interpolates from the previous position.
+
+        Nothing is queued when it is outside the view of camera, the level
+        of detail follows the distance to it.
+        """
+        model = queue.ctx.get_model(self.model, "default")
+        pos = self.interpolate(alpha)
+        if not visible_spheres(camera.frustum(), pos, model.radius)[0]:
+            return
+        self._update_transform(alpha)
+        if model.position_scale != 1.0:
+            # rows scale the model axes, the translation row stays put
+            self.transform[:3] *= model.position_scale
+        depth = view_depth(camera, self.transform[3, :3])
+        thresholds = lod_distances(model.radius, len(model.lods), camera.fov)
+        self.lod = int(select_lods(depth, self.lod, thresholds))
+        queue.submit(self.render, OPAQUE, "42run", model.texture, self.model, depth)
+
+    def render(self, ctx, camera):
+        """Draw da thing with the transform computed by draw."""
+        model = ctx.get_model(self.model, "default")
+        ctx.use_vao("default", model)
         ctx.use_program("42run")
-        self._update_transform()
-        camera_uniforms = camera.gen_uniforms(self.transform)
-        model = ctx.get_model(self.model)
-        ctx.update_uniforms(camera_uniforms)
-        glBindTexture(GL_TEXTURE_2D, model.texture)
-        glActiveTexture(GL_TEXTURE0)
-        glDrawArrays(GL_TRIANGLES, model.offset, model.indices)
+        ctx.update_uniforms({"M": self.transform})
+        ctx.enable(GL_DEPTH_TEST)
+        ctx.bind_texture(GL_TEXTURE_2D, model.texture)
+        indices, index_ptr = model.lods[self.lod]
+        glDrawElementsBaseVertex(
+            GL_TRIANGLES, indices, model.index_type, index_ptr, model.base_vertex
+        )
         # err = glGetError()
         # if err != GL_NO_ERROR:
         #    exit("GLERROR: ", gluErrorString(err))
@@ -53,14 +105,143 @@ class DrawableEntity(Drawable):
         return self.alive
 
 
+class EntityStore:
+    """Structure-of-arrays storage for entity state.
+
+    Live entities occupy slots [0, count) of every array. Removing entities
+    swaps live slots from the end into the holes, handles stay valid through
+    the handle_slot indirection and are recycled through a free list.
+    """
+
+    FIELDS = {
+        "pos": ((3,), np.float32),
+        "prev_pos": ((3,), np.float32),
+        "rot": ((3,), np.float32),
+        "rot_vel": ((3,), np.float32),
+        "alive": ((), np.bool_),
+        "hitogram": ((3,), np.int8),
+        "handle": ((), np.int64),
+    }
+
+    def __init__(self, capacity=64):
+        """Create store."""
+        self.count = 0
+        self.capacity = 0
+        self.next_handle = 0
+        self.free_handles = []
+        self.handle_slot = np.empty(0, dtype=np.int64)
+        for name, (shape, dtype) in self.FIELDS.items():
+            setattr(self, name, np.zeros((0,) + shape, dtype=dtype))
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        for name, (shape, dtype) in self.FIELDS.items():
+            grown = np.zeros((capacity,) + shape, dtype=dtype)
+            grown[: self.count] = getattr(self, name)[: self.count]
+            setattr(self, name, grown)
+        handle_slot = np.full(capacity, -1, dtype=np.int64)
+        handle_slot[: self.next_handle] = self.handle_slot[: self.next_handle]
+        self.handle_slot = handle_slot
+        self.capacity = capacity
+
+    def add(self, pos=[0, 0, 0], rot=[0, 0, 0]):
+        """Add a live entity and return its handle."""
+        if self.count == self.capacity:
+            self._grow(max(self.capacity * 2, 1))
+        if self.free_handles:
+            handle = self.free_handles.pop()
+        else:
+            handle = self.next_handle
+            self.next_handle += 1
+        slot = self.count
+        self.count += 1
+        self.handle_slot[handle] = slot
+        self.handle[slot] = handle
+        self.pos[slot] = pos
+        self.prev_pos[slot] = pos
+        self.rot[slot] = rot
+        self.rot_vel[slot] = 0.0
+        self.hitogram[slot] = 0
+        self.alive[slot] = True
+        return handle
+
+    def save_state(self):
+        """Remember current positions to interpolate renders from."""
+        np.copyto(self.prev_pos[: self.count], self.pos[: self.count])
+
+    def interpolated_pos(self, alpha):
+        """Positions alpha of the way from the saved to the current state."""
+        n = self.count
+        pos = self.pos[:n] - self.prev_pos[:n]
+        pos *= alpha
+        pos += self.prev_pos[:n]
+        return pos
+
+    def compact(self):
+        """Drop dead entities, return the number removed.
+
+        Handles of removed entities are recycled, views over them must not
+        be used afterwards.
+        """
+        n = self.count
+        dead = np.flatnonzero(~self.alive[:n])
+        if not len(dead):
+            return 0
+        new_count = n - len(dead)
+        dead_handles = self.handle[dead]
+        holes = dead[dead < new_count]
+        movers = np.flatnonzero(self.alive[new_count:n]) + new_count
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            array[holes] = array[movers]
+        self.handle_slot[dead_handles] = -1
+        self.handle_slot[self.handle[holes]] = holes
+        self.free_handles.extend(dead_handles.tolist())
+        self.count = new_count
+        return len(dead)
+
+
 class Entity:
-    """Game Entity without builtin drawable."""
+    """Game Entity without builtin drawable, a view into an EntityStore."""
+
+    __slots__ = ("store", "handle")
 
-    def __init__(self, pos=[0, 0, 0], rot=[0, 0, 0]):
+    def __init__(self, store, pos=[0, 0, 0], rot=[0, 0, 0]):
         """Create entity."""
-        self.pos = np.array(pos, dtype=np.float32)
-        self.rot = np.array(rot, dtype=np.float32)
-        self.alive = True
+        self.store = store
+        self.handle = store.add(pos, rot)
+
+    @property
+    def slot(self):
+        """Current slot of this entity in its store."""
+        return self.store.handle_slot[self.handle]
+
+    @property
+    def pos(self):
+        """Position, a view into the store."""
+        return self.store.pos[self.slot]
+
+    @pos.setter
+    def pos(self, value):
+        self.store.pos[self.slot] = value
+
+    @property
+    def rot(self):
+        """Rotation, a view into the store."""
+        return self.store.rot[self.slot]
+
+    @rot.setter
+    def rot(self, value):
+        self.store.rot[self.slot] = value
+
+    @property
+    def alive(self):
+        """Is alive?."""
+        return bool(self.store.alive[self.slot])
+
+    @alive.setter
+    def alive(self, value):
+        self.store.alive[self.slot] = value
 
     def update(self, dt, ctx, win):
         """Update."""
@@ -0,0 +1,62 @@
+"""Stand-ins for the window and render context when running without a GPU."""
+
+import random
+import glfw
+
+
+class ScriptedWindow:
+    """Window replacement that plays back seeded random key presses.
+
+    Time advances by frame_time on every swap_buffers, so a run depends only
+    on the seed and frame count, never on how fast the host is.
+    """
+
+    KEYS = [glfw.KEY_A, glfw.KEY_D, glfw.KEY_SPACE]
+
+    def __init__(self, frames, seed=None, frame_time=1.0 / 60.0):
+        """Create window."""
+        self.frames = frames
+        self.frame = 0
+        self.frame_time = frame_time
+        self.width = 1024
+        self.height = 1024
+        self.keys = {}
+        self.rng = random.Random(seed)
+        self._press_keys()
+
+    def __bool__(self):
+        """Return false once every frame has been played."""
+        return self.frame < self.frames
+
+    def _press_keys(self):
+        self.keys = {}
+        if self.rng.random() < 0.05:
+            self.keys[self.rng.choice(self.KEYS)] = True
+
+    def time(self):
+        """Simulated seconds since the start of the run."""
+        return self.frame * self.frame_time
+
+    def key(self, k):
+        """Query keypress."""
+        return self.keys.get(k, False)
+
+    def close(self):
+        """Close the window."""
+        self.frame = self.frames
+
+    def swap_buffers(self):
+        """End the frame and script the next one's input."""
+        self.frame += 1
+        self._press_keys()
+
+
+class NullContext:
+    """Render context replacement for simulation only runs."""
+
+    def __getattr__(self, name):
+        """Every context call is a no-op."""
+        return self._noop
+
+    def _noop(self, *args, **kwargs):
+        return None
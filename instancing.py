@@ -0,0 +1,189 @@
+"""Instanced rendering of repeated drawables."""
+
+import ctypes
+from functools import partial
+import numpy as np
+import OpenGL
+
+OpenGL.ERROR_CHECKING = False
+from OpenGL.GL import *
+from culling import visible_spheres
+from lod import lod_distances, select_lods
+from transform import model_matrices
+from renderqueue import OPAQUE
+
+# a mat4 attribute takes four consecutive vec4 locations
+INSTANCE_LOCATION = 3
+MATRIX_SIZE = np.dtype(np.float32).itemsize * 16
+
+
+class InstancedRenderer:
+    """Draws every submitted drawable of a model with one instanced call."""
+
+    def __init__(self, ctx, program="42run_instanced", capacity=64):
+        """Create renderer."""
+        ctx.create_program(program, vert_name="42run_instanced", frag_name="42run")
+        self.program = program
+        self.capacity = 0
+        self.queues = {}
+        # level of detail of every instance key, per model
+        self.lods = {}
+        self._reserve(capacity)
+
+    def submit(self, drawable):
+        """Queue a drawable for this frame."""
+        self.submit_many(
+            drawable.model, drawable.pos[np.newaxis], drawable.rot[np.newaxis]
+        )
+
+    def submit_many(self, model_name, pos, rot=None, keys=None):
+        """Queue (N,3) positions and eulers of one model for this frame.
+
+        keys are stable non-negative ids of the instances, like entity
+        handles, they let an instance keep its level of detail near a switch.
+        """
+        if not len(pos):
+            return
+        self.queues.setdefault(model_name, []).append((pos, rot, keys))
+
+    def _reserve(self, count):
+        if count <= self.capacity:
+            return
+        self.capacity = max(count, self.capacity * 2)
+        self.pos = np.empty((self.capacity, 3), dtype=np.float32)
+        self.rot = np.empty((self.capacity, 3), dtype=np.float32)
+        self.keys = np.empty(self.capacity, dtype=np.int64)
+        self.matrices = np.empty((self.capacity, 4, 4), dtype=np.float32)
+
+    def _select_lods(self, model_name, keys, depth, thresholds):
+        """Levels of detail of instances at depth, remembered per key."""
+        keyed = keys >= 0
+        # instances without a key have no previous level
+        current = np.searchsorted(thresholds, depth)
+        if keyed.any():
+            state = self.lods.get(model_name, np.zeros(0, dtype=np.int8))
+            if keys.max() >= len(state):
+                grown = np.zeros(max(keys.max() + 1, len(state) * 2), dtype=np.int8)
+                grown[: len(state)] = state
+                state = self.lods[model_name] = grown
+            current[keyed] = state[keys[keyed]]
+        lods = select_lods(depth, current, thresholds)
+        if keyed.any():
+            state[keys[keyed]] = lods[keyed]
+        return lods
+
+    def _bind_instances(self, base):
+        """Point the per-instance matrix attribute at byte offset base."""
+        for i in range(4):
+            location = INSTANCE_LOCATION + i
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(
+                location,
+                4,
+                GL_FLOAT,
+                GL_FALSE,
+                MATRIX_SIZE,
+                ctypes.c_void_p(base + i * 16),
+            )
+            glVertexAttribDivisor(location, 1)
+
+    def draw(self, queue, camera):
+        """Upload this frame's instance matrices and queue them, then reset.
+
+        Instances outside the view of camera are dropped before anything is
+        uploaded, a model with none left costs no draw. The rest are drawn
+        with one call per level of detail.
+        """
+        count = sum(len(entry[0]) for queue in self.queues.values() for entry in queue)
+        if not count:
+            return
+        self._reserve(count)
+        ctx = queue.ctx
+        planes = camera.frustum()
+        i = 0
+        batches = []
+        for model_name, model_queue in self.queues.items():
+            first = i
+            for pos, rot, keys in model_queue:
+                self.pos[i : i + len(pos)] = pos
+                if rot is None:
+                    self.rot[i : i + len(pos)] = 0.0
+                else:
+                    self.rot[i : i + len(pos)] = rot
+                if keys is None:
+                    self.keys[i : i + len(pos)] = -1
+                else:
+                    self.keys[i : i + len(pos)] = keys
+                i += len(pos)
+            model = ctx.get_model(model_name, "default")
+            visible = first + np.flatnonzero(
+                visible_spheres(planes, self.pos[first:i], model.radius)
+            )
+            i = first + len(visible)
+            if not len(visible):
+                continue
+            depth = np.linalg.norm(self.pos[visible] - camera.pos, axis=1)
+            thresholds = lod_distances(model.radius, len(model.lods), camera.fov)
+            lods = self._select_lods(model_name, self.keys[visible], depth, thresholds)
+            # by level of detail, then front to back inside each level
+            order = np.lexsort((depth, lods))
+            self.pos[first:i] = self.pos[visible[order]]
+            self.rot[first:i] = self.rot[visible[order]]
+            levels, starts, counts = np.unique(
+                lods[order], return_index=True, return_counts=True
+            )
+            nearest = depth[order][starts]
+            for level, start, instances, near in zip(
+                levels.tolist(), starts.tolist(), counts.tolist(), nearest.tolist()
+            ):
+                batches.append((model_name, level, first + start, instances, near))
+        self.queues = {}
+        count = i
+        if not count:
+            return
+        # the ring buffer mapping is write only, matrices are finished here
+        # and copied into this frame's region once
+        M = model_matrices(self.pos[:count], self.rot[:count], self.matrices[:count])
+        for model_name, lod, first, instances, depth in batches:
+            model = ctx.get_model(model_name, "default")
+            if model.position_scale != 1.0:
+                M[first : first + instances, :3] *= model.position_scale
+        ring = ctx.dynamic_buffer()
+        mapped, offset = ring.array((count, 4, 4), np.float32)
+        mapped[...] = M
+
+        for model_name, lod, first, instances, depth in batches:
+            model = ctx.get_model(model_name, "default")
+            queue.submit(
+                partial(
+                    self.render,
+                    model_name,
+                    lod,
+                    offset + first * MATRIX_SIZE,
+                    instances,
+                ),
+                OPAQUE,
+                self.program,
+                model.texture,
+                model_name,
+                depth,
+            )
+
+    def render(self, model_name, lod, base, instances, ctx, camera):
+        """Draw instances of a model whose matrices start at byte offset base."""
+        model = ctx.get_model(model_name, "default")
+        ctx.use_vao("default", model)
+        ctx.use_program(self.program)
+        ctx.enable(GL_DEPTH_TEST)
+        glBindBuffer(GL_ARRAY_BUFFER, ctx.dynamic_buffer().buffer_id)
+        self._bind_instances(base)
+        ctx.bind_texture(GL_TEXTURE_2D, model.texture)
+        indices, index_ptr = model.lods[lod]
+        glDrawElementsInstancedBaseVertex(
+            GL_TRIANGLES,
+            indices,
+            model.index_type,
+            index_ptr,
+            instances,
+            model.base_vertex,
+        )
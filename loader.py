@@ -0,0 +1,126 @@
+"""Parallel asset loading."""
+
+import os
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import mesh
+import texcache
+
+
+class AssetLoader:
+    """Loads models and textures on worker pools, uploads on the GL thread.
+
+    Model parsing is pure Python and holds the GIL, so stale meshes are
+    rebuilt in worker processes. Image decoding runs in PIL, which releases
+    the GIL, so textures are decoded on threads. Workers only ever return
+    ready to upload arrays, finish() drains them into GL as they complete.
+    Assets with a fresh cache skip the pools entirely.
+    """
+
+    def __init__(self, ctx, workers=None):
+        """Create loader, workers defaults to the number of cores."""
+        self.ctx = ctx
+        self.workers = workers or os.cpu_count() or 1
+        self.processes = None
+        self.threads = None
+        # (futures, upload) pairs, upload gets the results on the GL thread
+        self.jobs = []
+        self.model_groups = []
+        self.scheduled = set()
+
+    def _process_pool(self):
+        if self.processes is None:
+            self.processes = ProcessPoolExecutor(self.workers)
+        return self.processes
+
+    def _thread_pool(self):
+        if self.threads is None:
+            self.threads = ThreadPoolExecutor(self.workers)
+        return self.threads
+
+    def _submit(self, futures, upload):
+        self.jobs.append((futures, upload))
+
+    def load_models(self, names, vao="default"):
+        """Queue models and their textures to be loaded into a vao.
+
+        Models already in the vao are skipped, like ctx.load_models does.
+        """
+        names = [name for name in names if name not in self.ctx.models[vao]]
+        meshes = {}
+        self.model_groups.append((names, vao, meshes))
+        for name in names:
+            cached = mesh.cached_mesh(name)
+            if cached is not None:
+                self._mesh_loaded(name, vao, meshes, [cached])
+                continue
+            future = self._process_pool().submit(mesh.build_mesh, name)
+            self._submit(
+                [future],
+                lambda results, name=name: self._mesh_loaded(
+                    name, vao, meshes, results
+                ),
+            )
+
+    def _mesh_loaded(self, name, vao, meshes, results):
+        meshes[name] = results[0]
+        for mat in results[0].materials:
+            if mat.texture:
+                self.load_texture(mat.texture, vao)
+
+    def load_texture(self, path, vao="default"):
+        """Queue a 2D texture to be loaded."""
+        self._load_texture(
+            (vao, path),
+            [path],
+            self.ctx.texture_format(),
+            lambda chains: self.ctx.load_texture(path, vao, chains),
+        )
+
+    def load_texture_cubemap(self, path, vao="default"):
+        """Queue a cubemap to be loaded."""
+        self._load_texture(
+            (vao, path),
+            self.ctx.cubemap_faces(path),
+            self.ctx.texture_format(alpha=False),
+            lambda chains: self.ctx.load_texture_cubemap(path, vao, chains),
+        )
+
+    def _load_texture(self, key, paths, internal_format, upload):
+        if key in self.scheduled or key[1] in self.ctx.textures[key[0]]:
+            return
+        self.scheduled.add(key)
+        if texcache.is_cached(paths, key[1], internal_format):
+            self._submit([], lambda results: upload(None))
+            return
+        # every cubemap face decodes on its own thread
+        futures = [self._thread_pool().submit(texcache.decode, p) for p in paths]
+        self._submit(futures, upload)
+
+    def finish(self):
+        """Upload every queued asset as it becomes ready, then shut down."""
+        while self.jobs:
+            ready = [job for job in self.jobs if all(f.done() for f in job[0])]
+            if not ready:
+                pending = [f for futures, _ in self.jobs for f in futures]
+                wait(pending, return_when=FIRST_COMPLETED)
+                continue
+            for job in ready:
+                self.jobs.remove(job)
+                futures, upload = job
+                # uploads may queue more jobs, like the textures of a model
+                upload([f.result() for f in futures])
+        for names, vao, meshes in self.model_groups:
+            # textures are uploaded by now, so load_models finds them loaded
+            self.ctx.load_models(names, vao, [meshes[name] for name in names])
+        self.model_groups = []
+        self.scheduled = set()
+        for pool in (self.processes, self.threads):
+            if pool is not None:
+                pool.shutdown()
+        self.processes = None
+        self.threads = None
@@ -0,0 +1,27 @@
+"""Level of detail selection."""
+
+import numpy as np
+
+# a coarser level is used once a model covers less than this share of the
+# screen height, one entry per level after the first
+LOD_SCREEN_SIZES = [0.1, 0.04, 0.015]
+# relative distance band around each switch that keeps the current level
+HYSTERESIS = 0.15
+
+
+def lod_distances(radius, levels, fov):
+    """Camera distances past which each coarser level of a model is used."""
+    sizes = np.array(LOD_SCREEN_SIZES[: levels - 1], dtype=np.float32)
+    return radius / (sizes * np.tan(np.radians(fov) / 2))
+
+
+def select_lods(distances, current, thresholds, hysteresis=HYSTERESIS):
+    """Levels of detail for distances, sticking to current near a switch.
+
+    A level only gets coarser once the distance is past its threshold by
+    hysteresis and finer once it is that far below it, so objects hovering
+    around a threshold do not flicker between levels.
+    """
+    finest = np.searchsorted(thresholds * (1 + hysteresis), distances)
+    coarsest = np.searchsorted(thresholds * (1 - hysteresis), distances)
+    return np.clip(current, finest, coarsest)
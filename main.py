@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 """main."""
 
+import argparse
 import ctypes
 import numpy as np
 import random
+import time
 from pyrr import matrix44
 from collections import deque
 from window import Window, glfw
-from entity import Entity, Drawable, DrawableEntity
+from entity import Entity, EntityStore, DrawableEntity
 from context import Context
+from loader import AssetLoader
+from headless import ScriptedWindow, NullContext
+from collector import FrameCollector
+from profiling import FrameProfiler, PhaseTimer, NullTimer
+from instancing import InstancedRenderer
+from renderqueue import RenderQueue
 from camera import Camera
+from clock import FixedStep
+from collision import CollisionIndex
 from skybox import Skybox
 from text import Text
 from typing import List
@@ -17,6 +27,8 @@ import math
 
 lanes = [3, 0, -3]
 speed = 35.0
+# hp lost per second spent inside an obstacle
+hit_damage = 60.0
 
 
 def ease_in_linear(t):
@@ -100,10 +112,10 @@ class Player(DrawableEntity):
         if self.jump:
             self.pos[1] = 3.5 * ease_out_cubic(self.jump_timer / self.jump_duration)
         else:
-            self.pos[1] = self.pos[1] * 0.8
+            self.pos[1] = self.pos[1] * 0.8 ** (dt * 60.0)
 
         if hits[self.lane] > self.jump:
-            self.hp -= 1
+            self.hp -= hit_damage * dt
 
         if self.hp <= 0:
             self.alive = False
@@ -132,94 +144,195 @@ def gen_hitogram():
 
 
 class Obstacle(Entity):
-    """Obstacle."""
+    """Obstacle, a view into the obstacle EntityStore.
+
+    Views are cursors, reset() moves one onto a newly spawned obstacle so a
+    single view serves every spawn.
+    """
+
+    __slots__ = ()
+
+    # model, minimum hitogram height and y offset of each stacked part
+    PARTS = [("table", 1, 0.0), ("mac", 2, 2.0)]
+
+    def __init__(self, store, pos, hitogram=None):
+        """Create an obstacle."""
+        self.store = store
+        self.reset(pos, hitogram)
+
+    def reset(self, pos, hitogram=None):
+        """Spawn a new obstacle at pos and point this view at it.
+
+        The previous obstacle of the view stays in the store. hitogram is
+        random if None.
+        """
+        self.handle = self.store.add(pos)
+        self.hitogram = gen_hitogram() if hitogram is None else hitogram
+        self.store.rot_vel[self.slot] = np.random.rand(3) * random.random()
+
+    @property
+    def hitogram(self):
+        """Obstacle height per lane, a view into the store."""
+        return self.store.hitogram[self.slot]
+
+    @hitogram.setter
+    def hitogram(self, value):
+        self.store.hitogram[self.slot] = value
+
+
+def update_obstacles(store, dt):
+    """Move, spin and despawn every obstacle in one vectorized step."""
+    n = store.count
+    pos = store.pos[:n]
+    store.alive[:n] &= pos[:, 2] >= -30
+    pos[:, 2] -= speed * dt
+    store.rot[:n] += store.rot_vel[:n] * dt
+
+
+def submit_obstacles(store, renderer, alpha=1.0):
+    """Queue the stacked parts of every obstacle on an instanced renderer."""
+    n = store.count
+    lane_x = np.array(lanes, dtype=np.float32)
+    render_pos = store.interpolated_pos(alpha)
+    for model_name, height, y in Obstacle.PARTS:
+        entity, lane = np.nonzero(store.hitogram[:n] >= height)
+        pos = render_pos[entity]
+        pos[:, 0] += lane_x[lane]
+        pos[:, 1] += y
+        # one key per entity and lane, so every stacked part keeps its level
+        renderer.submit_many(
+            model_name, pos, keys=store.handle[entity] * len(lanes) + lane
+        )
 
-    def __init__(self, pos):
-        """Create a player."""
-        super().__init__(pos=pos)
-        self.drawables = []
-        self.offsets = []
-        self.hitogram = gen_hitogram()
-        for i, h in enumerate(self.hitogram):
-            while h:
-                if h == 2:
-                    self.drawables.append(Drawable("mac"))
+
+class World:
+    """Simulation state of a run, advanced in fixed steps."""
+
+    def __init__(self, timer=None):
+        """Create world, timer collects per phase timings if given."""
+        self.timer = timer or NullTimer()
+        self.player = Player()
+        self.obstacles = EntityStore()
+        self.collisions = CollisionIndex()
+        self.spawn_timer = 0.0
+        self.spawn_delay = 4.0
+        self.spawn_pos = np.array([0, 1, 200], dtype=np.float32)
+        self.spawned = None
+
+    def __bool__(self) -> bool:
+        """Is the run still going?."""
+        return bool(self.player)
+
+    def step(self, dt, ctx, window):
+        """Advance the simulation by one fixed step of dt."""
+        self.player.save_state()
+        self.obstacles.save_state()
+
+        with self.timer.phase("update"):
+            self.spawn_timer += dt
+            if self.spawn_timer > self.spawn_delay:
+                # Spawn new Obstacle
+                self.spawn_timer = 0.0
+                if self.spawned is None:
+                    self.spawned = Obstacle(self.obstacles, self.spawn_pos)
                 else:
-                    self.drawables.append(Drawable("table"))
-                self.offsets.append((lanes[i], (h - 1) * 2))
-                h -= 1
-        self.pos[1] = 1
-        self.rot_vel = np.random.rand(3) * random.random()
+                    self.spawned.reset(self.spawn_pos)
+                self.collisions.insert(self.spawned.pos[2], self.spawned.hitogram)
 
-    def update(self, dt, ctx, win):
-        """Update."""
-        if self.pos[2] < -30:
-            self.alive = False
-            return
-        self.pos[2] -= speed * dt
-        self.rot += self.rot_vel * dt
-        for d, (off_x, off_y) in zip(self.drawables, self.offsets):
-            np.copyto(d.pos, self.pos)
-            d.pos[0] += off_x
-            d.pos[1] += off_y
-            # np.copyto(d.rot, self.rot)
-
-    def draw(self, ctx, camera):
-        for d in self.drawables:
-            d.draw(ctx, camera)
-
-
-def game(window: Window, ctx: Context):
-    """Run game."""
+            if self.spawn_delay > 0.8:
+                self.spawn_delay -= dt * 0.1
+
+            update_obstacles(self.obstacles, dt)
+
+        with self.timer.phase("collision"):
+            self.collisions.prune(-30)
+            self.collisions.advance(speed * dt)
+            player_z = self.player.pos[2]
+            hits = self.collisions.query(player_z - 1.0, player_z + 1.0)
+
+        with self.timer.phase("compaction"):
+            self.obstacles.compact()
+
+        with self.timer.phase("update"):
+            self.player.update(dt, ctx, window, hits)
+
+    def draw(self, queue, camera, renderer, alpha):
+        """Queue obstacles and player interpolated alpha of a step ahead."""
+        submit_obstacles(self.obstacles, renderer, alpha)
+        renderer.draw(queue, camera)
+        self.player.draw(queue, camera, alpha)
+
+
+def score_text(now, hp):
+    """Format the score and hp line."""
+    return str(now)[: str(now).find(".") + 2] + f"\n hp{math.ceil(hp)}"
+
+
+def game(window: Window, ctx: Context, timer=None, overlay=False, collector=None):
+    """Run game, timer collects per phase and per frame timings if given.
+
+    overlay shows the summary of a FrameProfiler timer on screen. Garbage
+    is collected between frames by collector, a FrameCollector is made if
+    None.
+    """
+    timer = timer or NullTimer()
+    collector = collector or FrameCollector()
     # load assets in the default vao
     ctx.use_vao("default")
-    entities = []
     textbox = Text(ctx, [-0.25, 7, -9], "<score>")
+    stats = Text(ctx, [1.1, 6.4, -9], "") if overlay else None
+    stats_time = 0.0
     cam = GameCamera()
-    player = Player()
+    world = World(timer)
     skybox = Skybox(ctx, "assets/skybox")
+    renderer = InstancedRenderer(ctx)
+    queue = RenderQueue(ctx)
 
+    # everything loaded until here lives for the whole run
+    collector.freeze()
+    collector.start()
     # mainloop
-    old_time = glfw.get_time()
-    spawn_timer = 0.0
-    spawn_delay = 4.0
-    while window and player:
-        hits = [0, 0, 0]
-        new_time = glfw.get_time()
-        dt = new_time - old_time
-        cam.wobble(dt)
-        cam.set_target_y(player.pos[1] * 0.2 + 5)
-        skybox.rot[2] += dt * 0.01
-
-        spawn_timer += dt
-        if spawn_timer > spawn_delay:
-            # Spawn new Obstacle
-            spawn_timer = 0.0
-            entities.append(Obstacle([0, 0, 200]))
-
-        if spawn_delay > 0.8:
-            spawn_delay -= dt * 0.1
-
-        for e in entities:
-            e.update(dt, ctx, window)
-            if e and abs(e.pos[2] - player.pos[2]) < 1.0:
-                hits = list(map(max, zip(hits, e.hitogram)))
-        entities = [e for e in entities if e]
-        player.update(dt, ctx, window, hits)
-        old_time = new_time
-
-        # Render
-        ctx.clear()
-        ctx.use_vao("default")
-        for entity in entities:
-            entity.draw(ctx, cam)
-        player.draw(ctx, cam)
-        skybox.draw(ctx, cam)
-        textbox.draw(ctx, cam)
-        textbox.update(
-            str(new_time)[: str(new_time).find(".") + 2] + f"\n hp{player.hp}"
-        )
-        window.swap_buffers()
+    old_time = window.time()
+    clock = FixedStep(now=old_time)
+    while window and world:
+        timer.begin_frame()
+        collector.begin_frame()
+        new_time = window.time()
+        with timer.phase("simulate"):
+            for _ in range(clock.tick(new_time)):
+                world.step(clock.step, ctx, window)
+
+            # visual only animation runs at the render rate
+            dt = new_time - old_time
+            old_time = new_time
+            player_pos = world.player.interpolate(clock.alpha)
+            cam.wobble(dt)
+            cam.set_target_y(player_pos[1] * 0.2 + 5)
+            skybox.rot[2] += dt * 0.01
+
+        with timer.phase("render"):
+            ctx.begin_frame()
+            ctx.clear()
+            with timer.phase("submit"):
+                world.draw(queue, cam, renderer, clock.alpha)
+                skybox.draw(queue, cam)
+                textbox.draw(queue, cam)
+                if stats:
+                    stats.draw(queue, cam)
+            with timer.phase("flush"):
+                queue.flush(cam)
+            ctx.end_frame()
+            with timer.phase("text"):
+                textbox.update(score_text(new_time, world.player.hp))
+                if stats and new_time - stats_time > 0.5:
+                    stats_time = new_time
+                    stats.update(timer.summary())
+        with timer.phase("gc"):
+            collector.end_frame()
+        with timer.phase("swap"):
+            window.swap_buffers()
+        timer.end_frame()
+    collector.stop()
     ctx.clear()
     return str(new_time)[: str(new_time).find(".") + 2]
 
@@ -228,27 +341,116 @@ def end_screen(window: Window, ctx: Context, score: str):
     cam = Camera(pos=[0, 6, -12], target=[0, 5, 0])
     ctx.load_models(["plane"])
     ctx.use_vao("default")
-    now = glfw.get_time()
+    clock = FixedStep(now=window.time())
     textbox = Text(ctx, [-0.25, 6, -9], "<msg>")
-    while glfw.get_time() < now + 4.0:
+    queue = RenderQueue(ctx)
+    while clock.time < 4.0:
+        clock.tick(window.time())
+        ctx.begin_frame()
         ctx.clear()
-        if glfw.get_time() < now + 2.0:
+        if clock.time < 2.0:
             textbox.update(f"Game Over", color=(255, 0, 0, 255))
         else:
             textbox.update(f"Score: {score}")
-        textbox.draw(ctx, cam)
+        textbox.draw(queue, cam)
+        queue.flush(cam)
+        ctx.end_frame()
         window.swap_buffers()
+    ctx.release()
     window.close()
 
 
+def run_headless(frames, seed):
+    """Run the simulation without a window or GPU and report timings."""
+    random.seed(seed)
+    np.random.seed(seed)
+    window = ScriptedWindow(frames, seed)
+    ctx = NullContext()
+    timer = PhaseTimer()
+    collector = FrameCollector(window.frame_time)
+    world = World(timer)
+    clock = FixedStep(now=window.time())
+    ticks = 0
+    runs = 1
+    start = time.perf_counter()
+    collector.freeze()
+    collector.start()
+    while window:
+        if not world:
+            world = World(timer)
+            runs += 1
+        collector.begin_frame()
+        for _ in range(clock.tick(window.time())):
+            world.step(clock.step, ctx, window)
+            ticks += 1
+        with timer.phase("text"):
+            score_text(window.time(), world.player.hp)
+        with timer.phase("gc"):
+            collector.end_frame()
+        window.swap_buffers()
+    collector.stop()
+    elapsed = time.perf_counter() - start
+    print(f"{frames} frames, {ticks} ticks, {runs} runs in {elapsed:.3f} s")
+    print(f"{ticks / elapsed:.0f} ticks/s, {frames / elapsed:.0f} frames/s")
+    print(timer.report())
+    print(collector.report())
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="42run")
+    parser.add_argument(
+        "--headless", action="store_true", help="simulate without a window"
+    )
+    parser.add_argument(
+        "--frames", type=int, default=3600, help="frames to simulate headless"
+    )
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument(
+        "--compress-textures",
+        action="store_true",
+        help="bake textures into a GPU compressed format",
+    )
+    parser.add_argument(
+        "--pack-vertices",
+        action="store_true",
+        help="store models in a packed 16 byte vertex format",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="show frame stats on screen and print frame time histograms",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
     """main."""
+    args = parse_args()
+    if args.headless:
+        run_headless(args.frames, args.seed)
+        exit()
     window = Window(1024, 1024)
 
-    ctx = Context()
+    ctx = Context(args.compress_textures, args.pack_vertices)
+    loader = AssetLoader(ctx)
+    loader.load_models(["marvin", "skybox", "table", "plane", "mac"])
+    loader.load_texture_cubemap("assets/skybox")
+    # compile shaders while the workers decode
     ctx.create_program("42run")
     ctx.create_program("text")
-    ctx.load_models(["marvin", "skybox", "table", "plane", "mac"])
-    score = game(window, ctx)
+    loader.finish()
+    if args.profile:
+        collector = FrameCollector()
+        timer = FrameProfiler(
+            ["simulate", "render", "swap"], ctx, dump_every=600, collector=collector
+        )
+        score = game(window, ctx, timer, overlay=True, collector=collector)
+        timer.close()
+        print(timer.dump())
+        print(timer.report())
+        print(collector.report())
+    else:
+        score = game(window, ctx)
     if window:
         end_screen(window, ctx, score)
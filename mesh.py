@@ -0,0 +1,522 @@
+"""Mesh loading and on-disk caching."""
+
+import hashlib
+import json
+import os
+import re
+import numpy as np
+
+CACHE_DIR = os.path.join(".cache", "meshes")
+CACHE_VERSION = 5
+VERTEX_FORMAT = "T2F_N3F_V3F"
+VERTEX_SIZE = 2 + 3 + 3
+# clustering cells along the longest side of each generated LOD
+LOD_GRID_SIZES = [48, 24, 12]
+# a LOD is only kept if it has at most this share of the previous triangles
+LOD_MIN_REDUCTION = 0.6
+
+
+class Material:
+    """Range of mesh indices drawn with a single texture."""
+
+    def __init__(self, name, offset, count, texture):
+        """Create material."""
+        self.name = name
+        self.offset = offset
+        self.count = count
+        self.texture = texture
+
+
+class Mesh:
+    """Unique T2F_N3F_V3F vertices, triangle indices and their materials.
+
+    lods are the [offset, count] index ranges of each level of detail,
+    finest first. Materials address the first one, coarser levels are drawn
+    with the texture of the last material.
+    """
+
+    def __init__(self, vertices, indices, materials, lods=None):
+        """Create mesh."""
+        self.vertices = vertices
+        self.indices = indices
+        self.materials = materials
+        self.lods = lods or [[0, len(indices)]]
+
+
+def _source_hash(obj_path):
+    """Hash an .obj file together with every .mtl file it references."""
+    digest = hashlib.sha1(f"{CACHE_VERSION}".encode("utf-8"))
+    with open(obj_path, "rb") as src:
+        obj_src = src.read()
+    digest.update(obj_src)
+    obj_dir = os.path.dirname(obj_path)
+    # a pattern starting with a literal is found by a fast scan, "^mtllib"
+    # would be tried at every byte
+    for match in re.finditer(rb"mtllib\s+(.+?)\s*$", obj_src, re.MULTILINE):
+        if match.start() and obj_src[match.start() - 1] != ord("\n"):
+            continue
+        mtl_name = match.group(1)
+        try:
+            with open(os.path.join(obj_dir, mtl_name.decode("utf-8")), "rb") as src:
+                digest.update(src.read())
+        except OSError:
+            digest.update(b"missing:" + mtl_name)
+    return digest.hexdigest()
+
+
+def _vertex_ranks(tris, vertex_count):
+    """Cuthill-McKee rank of every vertex of a triangle list.
+
+    Every connected component is walked breadth first from its lowest
+    degree vertex, children in order of their parent and then by degree.
+    All components advance together, one level per step, so the cost is
+    a few NumPy calls per level instead of a Python loop per triangle.
+    """
+    # the neighbours of a vertex are the other two corners of its triangles
+    tris = tris.astype(np.int64)
+    corners = np.argsort(tris.ravel(), kind="stable")
+    tri, corner = np.divmod(corners, 3)
+    neighbours = np.stack(
+        [tris[tri, (corner + 1) % 3], tris[tri, (corner + 2) % 3]], axis=1
+    ).ravel()
+    vertex = np.repeat(tris.ravel()[corners], 2)
+    degree = np.bincount(vertex, minlength=vertex_count)
+    start = np.concatenate([[0], np.cumsum(degree)])
+    # components by propagating the smallest vertex id, with pointer jumping
+    label = np.arange(vertex_count)
+    while True:
+        low = label.copy()
+        np.minimum.at(low, vertex, label[neighbours])
+        low = low[low]
+        if np.array_equal(low, label):
+            break
+        label = low
+    by_degree = np.lexsort((degree, label))
+    first = np.concatenate([[True], label[by_degree][1:] != label[by_degree][:-1]])
+    frontier = by_degree[first]
+    level = np.full(vertex_count, -1, dtype=np.int64)
+    position = np.zeros(vertex_count, dtype=np.int64)
+    level[frontier] = 0
+    depth = 0
+    while len(frontier):
+        position[frontier] = np.arange(len(frontier))
+        depth += 1
+        count = degree[frontier]
+        skip = np.repeat(start[frontier] - np.cumsum(count) + count, count)
+        child = neighbours[skip + np.arange(len(skip))]
+        parent = np.repeat(frontier, count)
+        new = level[child] < 0
+        child, parent = child[new], parent[new]
+        child = child[np.lexsort((degree[child], position[parent]))]
+        # a child reached from several parents goes with the first
+        _, first = np.unique(child, return_index=True)
+        frontier = child[np.sort(first)]
+        level[frontier] = depth
+    ranks = np.empty(vertex_count, dtype=np.int64)
+    ranks[np.lexsort((position, level, label))] = np.arange(vertex_count)
+    return ranks
+
+
+def _reorder_triangles(tris, vertex_count):
+    """Reorder triangles for the post-transform vertex cache.
+
+    Triangles are sorted by the Cuthill-McKee rank of their last vertex,
+    see _vertex_ranks, so they follow a narrow front across the mesh and
+    mostly reuse vertices that were just transformed. Only runs when a mesh
+    is (re)built, never on a warm start.
+    """
+    if not len(tris):
+        return tris
+    ranks = np.sort(_vertex_ranks(tris, vertex_count)[tris], axis=1)
+    return tris[np.lexsort((ranks[:, 1], ranks[:, 2]))]
+
+
+def _build_indexed(vertices, ranges):
+    """Deduplicate vertices and build a cache-optimized index buffer.
+
+    ranges holds the (offset, count) vertex range of each material. Every
+    input vertex becomes one index and triangles never move between
+    materials, so the same ranges address the returned index buffer.
+    """
+    # rows compare as raw bytes, much faster than np.unique(axis=0)
+    rows = np.ascontiguousarray(vertices)
+    rows = rows.view(np.dtype((np.void, rows.itemsize * rows.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return _optimize_indices(vertices[first], inverse.reshape(-1), ranges)
+
+
+def _optimize_indices(unique, inverse, ranges):
+    """Reorder the triangles and vertices of an index buffer for the cache.
+
+    inverse indexes unique, ranges are as in _build_indexed. Vertices no
+    triangle uses are dropped.
+    """
+    tris = inverse.reshape(-1, 3)
+    parts = [
+        _reorder_triangles(tris[offset // 3 : (offset + count) // 3], len(unique))
+        for offset, count in ranges
+    ]
+    indices = np.concatenate(parts).ravel() if parts else inverse
+    # renumber vertices in order of first use so fetches are sequential
+    used, first_use = np.unique(indices, return_index=True)
+    order = used[np.argsort(first_use)]
+    remap = np.empty(len(unique), dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    vertices = unique[order]
+    index_dtype = np.uint16 if len(vertices) <= 0xFFFF else np.uint32
+    return vertices, remap[indices].astype(index_dtype)
+
+
+WHITESPACE = np.array([ord(c) for c in " \t\r\n"], dtype=np.uint8)
+
+
+class _Lines:
+    """Lines of a text file, located with NumPy over its bytes."""
+
+    def __init__(self, data):
+        """Index the lines of data."""
+        self.data = data
+        # the padding lets keyword() read the first bytes of any line
+        self.chars = np.frombuffer(data + b"\n" * 8, dtype=np.uint8)
+        self.ends = np.flatnonzero(self.chars[: len(data) + 1] == ord("\n"))
+        self.starts = np.concatenate([[0], self.ends[:-1] + 1])
+
+    def text(self, line):
+        """Bytes of a line."""
+        return self.data[self.starts[line] : self.ends[line]]
+
+    def keyword(self, keyword):
+        """Indices of the lines starting with keyword then whitespace."""
+        match = np.isin(self.chars[self.starts + len(keyword)], WHITESPACE)
+        for i, char in enumerate(keyword):
+            match &= self.chars[self.starts + i] == char
+        return np.flatnonzero(match)
+
+    def payload(self, lines, keyword):
+        """Bytes of lines without their keyword, newline separated."""
+        if not len(lines):
+            return b""
+        if lines[-1] - lines[0] + 1 == len(lines):
+            # records of a kind are usually one block, slice it whole
+            text = self.data[self.starts[lines[0]] : self.ends[lines[-1]]]
+            return text[len(keyword) :].replace(b"\n" + keyword, b"\n")
+        return b"\n".join(self.text(line)[len(keyword) :] for line in lines)
+
+
+def _floats(lines, keyword, width):
+    """Parse the first width numbers of keyword lines into an (N,width) array."""
+    records = lines.keyword(keyword)
+    text = lines.payload(records, keyword)
+    values = np.fromstring(text, dtype=np.float32, sep=" ")
+    if len(values) != len(records) * width:
+        # some records carry optional components, like w or vertex colors
+        values = np.array(
+            [line.split()[:width] for line in text.splitlines()], dtype=np.float32
+        )
+    return values.reshape(-1, width)
+
+
+def _read_materials(obj_dir, lines):
+    """Texture path of every material in the .mtl files an .obj references."""
+    textures = {}
+    for line in lines.keyword(b"mtllib"):
+        mtl_name = lines.text(line).split(maxsplit=1)[1].strip()
+        mtl_path = os.path.join(obj_dir, mtl_name.decode("utf-8"))
+        try:
+            with open(mtl_path, "rb") as src:
+                mtl = src.read()
+        except OSError:
+            exit(f"Error reading material library: {mtl_path}")
+        name = None
+        for mtl_line in mtl.splitlines():
+            words = mtl_line.split()
+            if len(words) > 1 and words[0] == b"newmtl":
+                name = words[1].decode("utf-8")
+                textures[name] = None
+            elif len(words) > 1 and words[0] == b"map_Kd" and name is not None:
+                # options come first, the file name last
+                textures[name] = os.path.join(obj_dir, words[-1].decode("utf-8"))
+    return textures
+
+
+def _read_obj(model_name, obj_path):
+    """Read an .obj file into T2F_N3F_V3F vertices, three per triangle.
+
+    The file is handled as one byte array, records of each keyword are
+    masked out of it and converted in bulk by NumPy, faces are assembled
+    by fancy indexing. Returns the vertices and the materials addressing
+    them.
+    """
+    with open(obj_path, "rb") as src:
+        data = src.read()
+    lines = _Lines(data)
+    textures = _read_materials(os.path.dirname(obj_path), lines)
+    face_lines = lines.keyword(b"f")
+    if not len(face_lines):
+        return np.zeros((0, VERTEX_SIZE), dtype=np.float32), []
+    text = lines.payload(face_lines, b"f")
+    # v/vt/vn corners have two slashes each
+    slashes = text.count(b"/")
+    if slashes == 6 * len(face_lines):
+        counts = np.full(len(face_lines), 3)
+    else:
+        chars = np.frombuffer(text, dtype=np.uint8)
+        line = np.cumsum(chars == ord("\n"))
+        counts = np.bincount(line[chars == ord("/")], minlength=len(face_lines))
+        counts //= 2
+    corners = np.fromstring(text.replace(b"/", b" "), dtype=np.int64, sep=" ")
+    # every corner must be v/vt/vn, the only format the renderer reads
+    if (
+        slashes != 2 * counts.sum()
+        or b"//" in text
+        or len(corners) != 3 * counts.sum()
+        or np.any(counts < 3)
+    ):
+        exit(f"Error in {model_name}.obj vertex format must be {VERTEX_FORMAT}")
+    corners = corners.reshape(-1, 3)
+    # negative indices count back from the last record before the face
+    face_of_corner = np.repeat(np.arange(len(face_lines)), counts)
+    for column, keyword in enumerate([b"v", b"vt", b"vn"]):
+        index = corners[:, column]
+        negative = index < 0
+        if negative.any():
+            before = np.searchsorted(lines.keyword(keyword), face_lines)
+            index[negative] += before[face_of_corner][negative] + 1
+        index -= 1
+
+    # fan triangulate every face
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    tri_face = np.repeat(np.arange(len(face_lines)), counts - 2)
+    tri_first = np.concatenate([[0], np.cumsum(counts - 2)[:-1]])
+    fan = np.arange(len(tri_face)) - tri_first[tri_face]
+    tris = starts[tri_face, np.newaxis] + np.stack(
+        [np.zeros_like(fan), fan + 1, fan + 2], axis=1
+    )
+
+    # group triangles by material in usemtl order, faces before the first
+    # usemtl get a default material
+    mtl_lines = lines.keyword(b"usemtl")
+    names = ["default"]
+    names += [lines.text(i).split()[1].decode("utf-8") for i in mtl_lines]
+    group_of_name = {}
+    mtl_group = np.array(
+        [group_of_name.setdefault(name, len(group_of_name)) for name in names]
+    )
+    tri_group = mtl_group[np.searchsorted(mtl_lines, face_lines)[tri_face]]
+    order = np.argsort(tri_group, kind="stable")
+    corners = corners[tris[order].ravel()]
+    try:
+        vertices = np.concatenate(
+            [
+                _floats(lines, b"vt", 2)[corners[:, 1]],
+                _floats(lines, b"vn", 3)[corners[:, 2]],
+                _floats(lines, b"v", 3)[corners[:, 0]],
+            ],
+            axis=1,
+        )
+    except IndexError:
+        exit(f"Error in {model_name}.obj face index out of range")
+    materials = []
+    group_counts = np.bincount(tri_group, minlength=len(group_of_name)) * 3
+    offset = 0
+    for name, group in group_of_name.items():
+        count = int(group_counts[group])
+        if count:
+            materials.append(Material(name, offset, count, textures.get(name)))
+            offset += count
+    return vertices, materials
+
+
+def _pack_rows(rows):
+    """One int64 per row of ints, equal only for equal rows.
+
+    Columns are digits of a mixed radix number, so the product of their
+    ranges has to fit in an int64.
+    """
+    key = np.zeros(len(rows), dtype=np.int64)
+    for column in rows.T:
+        column = column - column.min(initial=0)
+        key *= int(column.max(initial=0)) + 1
+        key += column
+    return key
+
+
+def _cluster(vertices, indices, grid_size):
+    """Simplify an indexed mesh by vertex clustering.
+
+    Vertices are snapped to a grid with grid_size cells along the longest
+    side of the mesh and every cell becomes one vertex with the mean
+    attributes of the vertices in it. Vertices only share a cell when they
+    also face the same axis and their texture coordinates fall in the same
+    cell of a grid_size texture grid, which keeps hard edges, texture seams
+    and decals. Triangles that collapse or repeat are dropped. Returns the
+    merged vertices and the index of the merged vertex of every triangle
+    corner.
+    """
+    positions = vertices[:, 5:8]
+    low = positions.min(axis=0)
+    cell = max(float((positions.max(axis=0) - low).max()), 1e-6) / grid_size
+    normals = vertices[:, 2:5]
+    axis = np.argmax(np.abs(normals), axis=1)
+    facing = axis * 2 + (normals[np.arange(len(normals)), axis] < 0)
+    keys = np.concatenate(
+        [
+            np.floor((positions - low) / cell),
+            np.floor(vertices[:, :2] * grid_size),
+            facing[:, np.newaxis],
+        ],
+        axis=1,
+    ).astype(np.int64)
+    _, cluster = np.unique(_pack_rows(keys), return_inverse=True)
+    count = np.bincount(cluster)
+    merged = np.empty((len(count), VERTEX_SIZE), dtype=np.float64)
+    for i in range(VERTEX_SIZE):
+        merged[:, i] = np.bincount(cluster, weights=vertices[:, i]) / count
+    normals = merged[:, 2:5]
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+
+    tris = cluster[indices.astype(np.int64)].reshape(-1, 3)
+    keep = (
+        (tris[:, 0] != tris[:, 1])
+        & (tris[:, 1] != tris[:, 2])
+        & (tris[:, 0] != tris[:, 2])
+    )
+    tris = tris[keep]
+    _, first_tri = np.unique(_pack_rows(np.sort(tris, axis=1)), return_index=True)
+    tris = tris[np.sort(first_tri)]
+    return merged.astype(np.float32), tris.ravel()
+
+
+def _build_lods(vertices, indices):
+    """Append coarser levels of detail to an indexed mesh.
+
+    Returns the vertices and indices of every level and their index ranges.
+    """
+    all_vertices = [vertices]
+    all_indices = [indices.astype(np.int64)]
+    lods = [[0, len(indices)]]
+    vertex_count = len(vertices)
+    for grid_size in LOD_GRID_SIZES:
+        if not len(indices):
+            break
+        merged, corners = _cluster(vertices, indices, grid_size)
+        if not len(corners) or len(corners) > LOD_MIN_REDUCTION * lods[-1][1]:
+            continue
+        lod_vertices, lod_indices = _optimize_indices(
+            merged, corners, [(0, len(corners))]
+        )
+        lods.append([lods[-1][0] + lods[-1][1], len(lod_indices)])
+        all_vertices.append(lod_vertices)
+        all_indices.append(lod_indices.astype(np.int64) + vertex_count)
+        vertex_count += len(lod_vertices)
+    index_dtype = np.uint16 if vertex_count <= 0xFFFF else np.uint32
+    vertices = np.concatenate(all_vertices)
+    return vertices, np.concatenate(all_indices).astype(index_dtype), lods
+
+
+def _parse(model_name, obj_path):
+    """Parse an .obj file into an indexed mesh with its levels of detail."""
+    vertices, materials = _read_obj(model_name, obj_path)
+    ranges = [(mat.offset, mat.count) for mat in materials]
+    vertices, indices = _build_indexed(vertices, ranges)
+    vertices, indices, lods = _build_lods(vertices, indices)
+    return Mesh(vertices, indices, materials, lods)
+
+
+def _cache_paths(model_name):
+    base = os.path.join(CACHE_DIR, model_name)
+    return base + ".json", base + ".bin"
+
+
+def _read_cache(model_name, source_hash):
+    """Memory-map a cached mesh, or return None if it is missing or stale."""
+    header_path, blob_path = _cache_paths(model_name)
+    try:
+        with open(header_path, "r") as src:
+            header = json.load(src)
+        if header["version"] != CACHE_VERSION or header["hash"] != source_hash:
+            return None
+        arrays = {}
+        for name, info in header["arrays"].items():
+            shape = tuple(info["shape"])
+            if 0 in shape:
+                arrays[name] = np.zeros(shape, dtype=info["dtype"])
+                continue
+            arrays[name] = np.memmap(
+                blob_path,
+                dtype=info["dtype"],
+                mode="r",
+                offset=info["offset"],
+                shape=shape,
+            )
+        materials = [Material(**mat) for mat in header["materials"]]
+        return Mesh(arrays["vertices"], arrays["indices"], materials, header["lods"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_cache(model_name, source_hash, mesh):
+    """Store a mesh as a raw blob plus a JSON header describing its layout."""
+    header_path, blob_path = _cache_paths(model_name)
+    arrays = {"vertices": mesh.vertices, "indices": mesh.indices}
+    header = {
+        "version": CACHE_VERSION,
+        "hash": source_hash,
+        "vertex_format": VERTEX_FORMAT,
+        "arrays": {},
+        "materials": [vars(mat) for mat in mesh.materials],
+        "lods": mesh.lods,
+    }
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(blob_path + ".tmp", "wb") as out:
+            for name, array in arrays.items():
+                # keep every array 16 byte aligned within the blob
+                out.write(b"\0" * (-out.tell() % 16))
+                header["arrays"][name] = {
+                    "dtype": array.dtype.str,
+                    "shape": list(array.shape),
+                    "offset": out.tell(),
+                }
+                out.write(np.ascontiguousarray(array).tobytes())
+        with open(header_path + ".tmp", "w") as out:
+            json.dump(header, out)
+        os.replace(blob_path + ".tmp", blob_path)
+        os.replace(header_path + ".tmp", header_path)
+    except OSError as e:
+        print(f"Warning: could not write mesh cache for {model_name}: {e}")
+
+
+def _obj_source(model_name):
+    """Path and source hash of assets/{model_name}.obj."""
+    obj_path = os.path.join("assets", model_name + ".obj")
+    try:
+        return obj_path, _source_hash(obj_path)
+    except OSError:
+        exit(f"Error reading model: {obj_path}")
+
+
+def cached_mesh(model_name):
+    """Memory-map the cached mesh of a model, or None if it is stale."""
+    obj_path, source_hash = _obj_source(model_name)
+    return _read_cache(model_name, source_hash)
+
+
+def build_mesh(model_name, source=None):
+    """Parse a model and cache it, safe to run in a worker process.
+
+    source is the (path, hash) of _obj_source if the caller has it.
+    """
+    obj_path, source_hash = source or _obj_source(model_name)
+    mesh = _parse(model_name, obj_path)
+    _write_cache(model_name, source_hash, mesh)
+    return mesh
+
+
+def load_mesh(model_name):
+    """Load assets/{model_name}.obj, using the mesh cache when it is fresh."""
+    source = _obj_source(model_name)
+    mesh = _read_cache(model_name, source[1])
+    if mesh is None:
+        mesh = build_mesh(model_name, source)
+    return mesh
@@ -0,0 +1,156 @@
+"""Offscreen rendering backend for machines without a display or GPU.
+
+PyOpenGL picks its platform on first import, so import this module before
+anything that imports OpenGL. The backend is EGL (surfaceless, works with
+Mesa llvmpipe) unless PYOPENGL_PLATFORM is set to osmesa.
+"""
+
+import os
+
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
+import ctypes
+import OpenGL
+
+# the EGL bindings need error checking enabled while they are imported
+if os.environ["PYOPENGL_PLATFORM"] == "egl":
+    from OpenGL import EGL
+OpenGL.ERROR_CHECKING = False
+from OpenGL.GL import *
+from headless import ScriptedWindow
+
+EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+
+
+def _create_egl_context():
+    display = EGL.eglGetPlatformDisplayEXT(
+        EGL_PLATFORM_SURFACELESS_MESA, EGL.EGL_DEFAULT_DISPLAY, None
+    )
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        exit("Error initializing EGL")
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    config = EGL.EGLConfig()
+    num_configs = EGL.EGLint()
+    config_attribs = (EGL.EGLint * 5)(
+        EGL.EGL_SURFACE_TYPE,
+        EGL.EGL_PBUFFER_BIT,
+        EGL.EGL_RENDERABLE_TYPE,
+        EGL.EGL_OPENGL_BIT,
+        EGL.EGL_NONE,
+    )
+    EGL.eglChooseConfig(
+        display, config_attribs, ctypes.pointer(config), 1, ctypes.pointer(num_configs)
+    )
+    if not num_configs.value:
+        exit("Error choosing EGL config")
+    context_attribs = (EGL.EGLint * 7)(
+        EGL.EGL_CONTEXT_MAJOR_VERSION,
+        4,
+        EGL.EGL_CONTEXT_MINOR_VERSION,
+        1,
+        EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK,
+        EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+        EGL.EGL_NONE,
+    )
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, context_attribs)
+    if not context or not EGL.eglMakeCurrent(
+        display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, context
+    ):
+        exit("Error creating EGL context")
+
+    def destroy():
+        EGL.eglMakeCurrent(
+            display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT
+        )
+        EGL.eglDestroyContext(display, context)
+        EGL.eglTerminate(display)
+
+    return destroy
+
+
+def _create_osmesa_context(width, height):
+    from OpenGL import osmesa, arrays
+
+    attribs = [
+        osmesa.OSMESA_FORMAT,
+        osmesa.OSMESA_RGBA,
+        osmesa.OSMESA_DEPTH_BITS,
+        24,
+        osmesa.OSMESA_PROFILE,
+        osmesa.OSMESA_CORE_PROFILE,
+        osmesa.OSMESA_CONTEXT_MAJOR_VERSION,
+        4,
+        osmesa.OSMESA_CONTEXT_MINOR_VERSION,
+        1,
+        0,
+    ]
+    context = osmesa.OSMesaCreateContextAttribs(attribs, None)
+    # osmesa needs a client side buffer even though we draw into an FBO
+    buffer = arrays.GLubyteArray.zeros((height, width, 4))
+    if not context or not osmesa.OSMesaMakeCurrent(
+        context, buffer, GL_UNSIGNED_BYTE, width, height
+    ):
+        exit("Error creating OSMesa context")
+
+    def destroy():
+        # osmesa keeps the buffer pointer, so the closure owns the buffer
+        nonlocal buffer
+        osmesa.OSMesaDestroyContext(context)
+        buffer = None
+
+    return destroy
+
+
+class OffscreenWindow(ScriptedWindow):
+    """Window replacement that renders into a framebuffer object.
+
+    Input and time are scripted like ScriptedWindow so runs are repeatable.
+    swap_buffers waits for the GPU to finish the frame, which makes frame
+    times comparable between runs.
+    """
+
+    def __init__(self, width, height, frames, seed=None, frame_time=1.0 / 60.0):
+        """Create an offscreen GL 4.1 core context and framebuffer."""
+        super().__init__(frames, seed, frame_time)
+        if os.environ["PYOPENGL_PLATFORM"] == "osmesa":
+            self._destroy = _create_osmesa_context(width, height)
+        else:
+            self._destroy = _create_egl_context()
+        self.width = width
+        self.height = height
+
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        self.color_rb, self.depth_rb = glGenRenderbuffers(2)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.color_rb)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glFramebufferRenderbuffer(
+            GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.color_rb
+        )
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth_rb)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+        glFramebufferRenderbuffer(
+            GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth_rb
+        )
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            exit("Error creating offscreen framebuffer")
+        glViewport(0, 0, width, height)
+
+    def read_pixels(self):
+        """Return the current frame as RGBA bytes, bottom row first."""
+        return glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE)
+
+    def close(self):
+        """Close the window."""
+        super().close()
+        if self._destroy:
+            glDeleteRenderbuffers(2, [self.color_rb, self.depth_rb])
+            glDeleteFramebuffers(1, [self.fbo])
+            self._destroy()
+            self._destroy = None
+
+    def swap_buffers(self):
+        """Finish the frame on the GPU and script the next one's input."""
+        glFinish()
+        super().swap_buffers()
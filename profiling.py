@@ -0,0 +1,304 @@
+"""Timing instrumentation."""
+
+import ctypes
+import functools
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import OpenGL
+
+OpenGL.ERROR_CHECKING = False
+from OpenGL.GL import *
+
+# the wrapped glGetQueryObjectui64v has no array type for 64 bit results
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+
+
+class PhaseTimer:
+    """Accumulates wall time spent in named phases.
+
+    Phases nest, a phase inside another is recorded as "outer/inner".
+    """
+
+    def __init__(self):
+        """Create timer."""
+        self.totals = {}
+        self.calls = {}
+        self.stack = []
+
+    @contextmanager
+    def phase(self, name):
+        """Time the body of a with block under name."""
+        self.stack.append(name)
+        name = "/".join(self.stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(name, time.perf_counter() - start)
+            self.stack.pop()
+
+    def timed(self, name):
+        """Decorate a function to time every call as phase name."""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _add(self, name, elapsed):
+        self.totals[name] = self.totals.get(name, 0.0) + elapsed
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def begin_frame(self):
+        """Mark the start of a frame."""
+        pass
+
+    def end_frame(self):
+        """Mark the end of a frame."""
+        pass
+
+    def report(self):
+        """Format total and mean time per call of every phase."""
+        lines = []
+        for name, total in self.totals.items():
+            mean = total / self.calls[name]
+            lines.append(
+                f"{name:>20}: {total * 1e3:9.2f} ms total"
+                + f" {mean * 1e6:9.2f} us/call ({self.calls[name]} calls)"
+            )
+        return "\n".join(lines)
+
+
+class FrameRecorder(PhaseTimer):
+    """PhaseTimer that also records selected phases of every frame."""
+
+    def __init__(self, columns):
+        """Create recorder, columns are the phase names to record."""
+        super().__init__()
+        self.columns = columns
+        self.rows = []
+        self.frame = {}
+        self.frame_start = None
+
+    def _add(self, name, elapsed):
+        super()._add(name, elapsed)
+        self.frame[name] = self.frame.get(name, 0.0) + elapsed
+
+    def begin_frame(self):
+        """Mark the start of a frame."""
+        self.frame = {}
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Record the phases and total time of the frame."""
+        total = time.perf_counter() - self.frame_start
+        self.rows.append([self.frame.get(c, 0.0) for c in self.columns] + [total])
+
+    def write_csv(self, path):
+        """Write one row per frame with times in milliseconds."""
+        with open(path, "w") as out:
+            header = ["frame"] + [f"{c}_ms" for c in self.columns] + ["total_ms"]
+            out.write(",".join(header) + "\n")
+            for i, row in enumerate(self.rows):
+                out.write(",".join([str(i)] + [f"{t * 1e3:.4f}" for t in row]) + "\n")
+
+
+class GpuTimer:
+    """Times frames on the GPU with GL_TIME_ELAPSED queries.
+
+    Results are read latency frames later, by then the GPU has finished
+    them so reading never stalls. A frame that finds every query still in
+    flight is not timed. On llvmpipe the first result is dropped, it
+    reports thousands of seconds for it.
+    """
+
+    def __init__(self, latency=3):
+        """Create timer with queries for latency frames in flight."""
+        self.free = [int(q) for q in np.atleast_1d(glGenQueries(latency + 1))]
+        self.pending = deque()
+        self.active = None
+        self.dropped = 0
+        self.warm = b"llvmpipe" not in (glGetString(GL_RENDERER) or b"")
+
+    def delete(self):
+        """Delete the queries, call while the context is current."""
+        queries = self.free + [query for _, query in self.pending]
+        if self.active is not None:
+            queries.append(self.active[1])
+        if queries:
+            glDeleteQueries(len(queries), queries)
+        self.free = []
+        self.pending.clear()
+        self.active = None
+
+    def begin(self, frame):
+        """Start timing frame."""
+        if not self.free:
+            self.dropped += 1
+            return
+        self.active = (frame, self.free.pop())
+        glBeginQuery(GL_TIME_ELAPSED, self.active[1])
+
+    def end(self):
+        """Stop timing the current frame."""
+        if self.active is None:
+            return
+        glEndQuery(GL_TIME_ELAPSED)
+        self.pending.append(self.active)
+        self.active = None
+
+    def poll(self):
+        """Return (frame, seconds) of every finished frame, oldest first."""
+        done = []
+        result = ctypes.c_uint64()
+        while self.pending:
+            frame, query = self.pending[0]
+            if not glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE):
+                break
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(result))
+            if self.warm:
+                done.append((frame, result.value * 1e-9))
+            self.warm = True
+            self.free.append(self.pending.popleft()[1])
+        return done
+
+
+class FrameProfiler(FrameRecorder):
+    """FrameRecorder that also tracks GPU time and render counters.
+
+    With a ctx, every frame records its GPU time and the draw calls, state
+    changes and bytes uploaded by ctx. With a FrameCollector it also counts
+    the allocations every frame left to the garbage collector. Frame times
+    of the last history frames are kept for percentiles, every dump_every
+    frames dump() is written to out.
+    """
+
+    def __init__(
+        self, columns, ctx=None, history=600, dump_every=0, out=None, collector=None
+    ):
+        """Create profiler, columns are the phase names to record."""
+        super().__init__(columns)
+        self.ctx = ctx
+        self.collector = collector
+        self.gpu = GpuTimer() if ctx is not None else None
+        self.history = history
+        self.dump_every = dump_every
+        self.out = out or sys.stdout
+        self.frame_times = deque(maxlen=history)
+        self.gpu_times = deque(maxlen=history)
+        self.frames = 0
+        self.counters = {}
+        self.start_counters = {}
+
+    def _ctx_counters(self):
+        return {
+            "draws": self.ctx.draw_calls,
+            "state changes": self.ctx.calls_issued,
+            "bytes": self.ctx.bytes_uploaded,
+        }
+
+    def begin_frame(self):
+        """Mark the start of a frame."""
+        super().begin_frame()
+        if self.ctx is not None:
+            self.start_counters = self._ctx_counters()
+        if self.gpu is not None:
+            self.gpu.begin(self.frames)
+
+    def end_frame(self):
+        """Record the frame, its counters and any GPU times that are ready."""
+        super().end_frame()
+        self.frame_times.append(self.rows[-1][-1])
+        if self.gpu is not None:
+            self.gpu.end()
+            self.gpu_times.extend(seconds for _, seconds in self.gpu.poll())
+        if self.ctx is not None:
+            counters = self._ctx_counters()
+            self.counters = {
+                name: counters[name] - self.start_counters[name] for name in counters
+            }
+        if self.collector is not None:
+            self.counters["allocs"] = self.collector.allocations
+        self.frames += 1
+        if self.dump_every and self.frames % self.dump_every == 0:
+            print(self.dump(), file=self.out)
+
+    def close(self):
+        """Delete the GPU queries, call before the window closes."""
+        if self.gpu is not None:
+            self.gpu.delete()
+            self.gpu = None
+
+    def percentiles(self, times=None):
+        """p50, p95 and p99 in milliseconds of the recent frame times."""
+        times = self.frame_times if times is None else times
+        if not times:
+            return [0.0, 0.0, 0.0]
+        return list(np.percentile(np.array(times) * 1e3, [50, 95, 99]))
+
+    def summary(self):
+        """One line overview of the recent frames, for an overlay."""
+        p50, p95, p99 = self.percentiles()
+        line = f"{p50:.1f}/{p95:.1f}/{p99:.1f} ms"
+        if self.gpu_times:
+            line += f" gpu {self.gpu_times[-1] * 1e3:.1f}"
+        if "draws" in self.counters:
+            line += (
+                f"\n{self.counters['draws']} draws"
+                + f" {self.counters['state changes']} states"
+                + f" {self.counters['bytes'] / 1024:.0f} KB"
+            )
+        if "allocs" in self.counters:
+            line += f"\n{self.counters['allocs']} allocs"
+        return line
+
+    def dump(self, bins=10):
+        """Format percentiles and a histogram of the recent frame times."""
+        times = np.array(self.frame_times) * 1e3
+        lines = [
+            f"last {len(times)} frames:"
+            + " p50 {:.2f} ms p95 {:.2f} ms p99 {:.2f} ms".format(*self.percentiles())
+        ]
+        if self.gpu_times:
+            lines.append(
+                " gpu p50 {:.2f} ms p95 {:.2f} ms p99 {:.2f} ms".format(
+                    *self.percentiles(self.gpu_times)
+                )
+            )
+        if len(times):
+            counts, edges = np.histogram(times, bins)
+            scale = 40 / counts.max()
+            for count, low, high in zip(counts, edges, edges[1:]):
+                bar = "#" * int(round(count * scale))
+                lines.append(f"{low:8.2f} - {high:8.2f} ms {count:6d} {bar}")
+        return "\n".join(lines)
+
+
+class NullTimer:
+    """PhaseTimer stand-in that measures nothing."""
+
+    _null = nullcontext()
+
+    def phase(self, name):
+        """Do nothing."""
+        return self._null
+
+    def timed(self, name):
+        """Return functions untouched."""
+        return lambda func: func
+
+    def begin_frame(self):
+        """Do nothing."""
+        pass
+
+    def end_frame(self):
+        """Do nothing."""
+        pass
@@ -0,0 +1,80 @@
+"""Sorted submission of draw calls."""
+
+import numpy as np
+
+# layers are drawn in this order
+OPAQUE = 0
+SKYBOX = 1
+OVERLAY = 2
+
+DEPTH_MAX = (1 << 24) - 1
+
+
+def view_depth(camera, pos):
+    """Distance from the camera to pos."""
+    return float(np.linalg.norm(pos - camera.pos))
+
+
+class RenderQueue:
+    """Collects a frame's draws and issues them in sort key order.
+
+    Keys are 64 bit, the layer in the top 4 bits. Opaque layers then sort
+    by program, texture and model to minimise state changes, with depth
+    front to back in the low 24 bits for early z rejection. Other layers
+    blend, so depth comes right after the layer and runs back to front.
+    """
+
+    def __init__(self, ctx, far=300.0):
+        """Create queue, depths are quantized over [0, far]."""
+        self.ctx = ctx
+        self.far = far
+        self.keys = []
+        self.draws = []
+        self.model_ids = {}
+
+    def __len__(self):
+        """Number of queued draws."""
+        return len(self.draws)
+
+    def sort_key(self, layer, program, texture=0, model=None, depth=0.0):
+        """Pack a draw's state and depth into a 64 bit sort key."""
+        # GL names come back as numpy integers, keep the key a python int
+        program_id = int(self.ctx.program_ids[program]) & 0xFF
+        texture_id = int(texture or 0) & 0xFFFF
+        model_id = self.model_ids.setdefault(model, len(self.model_ids)) & 0xFFF
+        depth_id = int(min(max(depth / self.far, 0.0), 1.0) * DEPTH_MAX)
+        if layer == OPAQUE or layer == SKYBOX:
+            return (
+                layer << 60
+                | program_id << 52
+                | texture_id << 36
+                | model_id << 24
+                | depth_id
+            )
+        return (
+            layer << 60
+            | (DEPTH_MAX - depth_id) << 36
+            | program_id << 28
+            | texture_id << 12
+            | model_id
+        )
+
+    def submit(self, draw, layer, program, texture=0, model=None, depth=0.0):
+        """Queue draw(ctx, camera) to be called when the queue is flushed."""
+        self.keys.append(self.sort_key(layer, program, texture, model, depth))
+        self.draws.append(draw)
+
+    def flush(self, camera):
+        """Upload the camera, issue the queued draws in key order and empty."""
+        if not self.draws:
+            return
+        self.ctx.update_uniform_block("Camera", camera.gen_camera_block())
+        if self.ctx.ring is not None:
+            self.ctx.ring.flush()
+        order = np.argsort(np.array(self.keys, dtype=np.uint64), kind="stable")
+        for i in order:
+            self.draws[i](self.ctx, camera)
+        # every queued draw issues exactly one draw call
+        self.ctx.draw_calls += len(self.draws)
+        self.keys = []
+        self.draws = []
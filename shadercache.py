@@ -0,0 +1,86 @@
+"""Linked program binaries cached on disk."""
+
+import hashlib
+import json
+import os
+import numpy as np
+import OpenGL
+
+OpenGL.ERROR_CHECKING = False
+from OpenGL.GL import *
+
+CACHE_DIR = os.path.join(".cache", "shaders")
+CACHE_VERSION = 1
+
+
+def supported():
+    """Can the driver save and load program binaries?."""
+    return glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+
+
+def source_hash(vert_src, frag_src):
+    """Hash shader sources with the driver that will compile them."""
+    digest = hashlib.sha1(f"{CACHE_VERSION}".encode("utf-8"))
+    digest.update(glGetString(GL_RENDERER) or b"")
+    digest.update(glGetString(GL_VERSION) or b"")
+    for src in (vert_src, frag_src):
+        digest.update(b"\0" + src.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cache_paths(name):
+    base = os.path.join(CACHE_DIR, name)
+    return base + ".json", base + ".bin"
+
+
+def read_program(name, program_hash):
+    """Load a cached program binary.
+
+    Returns the program id and the reflection stored with it, or None if
+    the cache is missing, stale or rejected by the driver.
+    """
+    header_path, blob_path = _cache_paths(name)
+    try:
+        with open(header_path, "r") as src:
+            header = json.load(src)
+        if header["version"] != CACHE_VERSION or header["hash"] != program_hash:
+            return None
+        binary = np.fromfile(blob_path, dtype=np.uint8)
+        binary_format = header["format"]
+        reflection = header["reflection"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    program_id = glCreateProgram()
+    glProgramBinary(program_id, binary_format, binary, len(binary))
+    # drivers reject binaries from other builds by failing the link
+    if glGetProgramiv(program_id, GL_LINK_STATUS) != GL_TRUE:
+        glDeleteProgram(program_id)
+        return None
+    return program_id, reflection
+
+
+def write_program(name, program_hash, program_id, reflection):
+    """Store the binary of a linked program and its reflection."""
+    header_path, blob_path = _cache_paths(name)
+    length = glGetProgramiv(program_id, GL_PROGRAM_BINARY_LENGTH)
+    if not length:
+        return
+    binary = np.empty(length, dtype=np.uint8)
+    written = np.zeros(1, dtype=np.int32)
+    binary_format = np.zeros(1, dtype=np.uint32)
+    glGetProgramBinary(program_id, length, written, binary_format, binary)
+    header = {
+        "version": CACHE_VERSION,
+        "hash": program_hash,
+        "format": int(binary_format[0]),
+        "reflection": reflection,
+    }
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        binary[: written[0]].tofile(blob_path + ".tmp")
+        with open(header_path + ".tmp", "w") as out:
+            json.dump(header, out)
+        os.replace(blob_path + ".tmp", blob_path)
+        os.replace(header_path + ".tmp", header_path)
+    except OSError as e:
+        print(f"Warning: could not write shader cache for {name}: {e}")
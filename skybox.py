@@ -1,9 +1,10 @@
 """Entity."""
 
-from pyrr import matrix44
 import numpy as np
 import OpenGL
 from math import pi
+from transform import model_matrices
+from renderqueue import SKYBOX
 
 OpenGL.ERROR_CHECKING = False
 from OpenGL.GL import *
@@ -14,33 +15,42 @@ class Skybox:
 
     def __init__(self, ctx, path):
         """Create entity."""
+        self.ctx = ctx
         self.skybox_texture_id = ctx.load_texture_cubemap(path)
         ctx.create_program("skybox")
         self.rot = np.array([0.0, 0.0, 0.0], dtype=np.float32)
+        self.transform = np.identity(4, dtype=np.float32)
 
     def __del__(self):
-        glDeleteTextures(self.skybox_texture_id)
+        self.ctx.delete_textures([self.skybox_texture_id])
 
-    def draw(self, ctx, camera):
+    def draw(self, queue, camera):
+        """Queue skybox after the opaque geometry."""
+        model_matrices(
+            camera.pos[np.newaxis], self.rot[np.newaxis], self.transform[np.newaxis]
+        )
+        scale = self.ctx.get_model("skybox", "default").position_scale
+        if scale != 1.0:
+            self.transform[:3] *= scale
+        queue.submit(self.render, SKYBOX, "skybox", self.skybox_texture_id, "skybox")
+
+    def render(self, ctx, camera):
         """Draw skybox."""
+        model = ctx.get_model("skybox", "default")
+        ctx.use_vao("default", model)
         ctx.use_program("skybox")
 
-        old_cull_face_mode = glGetIntegerv(GL_CULL_FACE_MODE)
-        old_depth_func_mode = glGetIntegerv(GL_DEPTH_FUNC)
-
-        glCullFace(GL_FRONT)
-        glDepthFunc(GL_LEQUAL)
-
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_CUBE_MAP, self.skybox_texture_id)
-        uniforms = camera.gen_uniforms(
-            matrix44.multiply(
-                matrix44.create_from_eulers(self.rot, dtype=np.float32),
-                matrix44.create_from_translation(camera.pos, dtype=np.float32),
-            )
+        ctx.enable(GL_DEPTH_TEST)
+        old_cull_face_mode = ctx.cull_face(GL_FRONT)
+        old_depth_func_mode = ctx.depth_func(GL_LEQUAL)
+        ctx.bind_texture(GL_TEXTURE_CUBE_MAP, self.skybox_texture_id)
+        ctx.update_uniforms({"M": self.transform})
+        glDrawElementsBaseVertex(
+            GL_TRIANGLES,
+            model.indices,
+            model.index_type,
+            model.index_ptr,
+            model.base_vertex,
         )
-        ctx.update_uniforms(uniforms)
-        model = ctx.get_model("skybox")
-        glDrawArrays(GL_TRIANGLES, model.offset, model.indices)
-        glCullFace(old_cull_face_mode)
-        glDepthFunc(old_depth_func_mode)
+        ctx.cull_face(old_cull_face_mode)
+        ctx.depth_func(old_depth_func_mode)
@@ -0,0 +1,261 @@
+"""Streaming uploads that do not stall the frame."""
+
+import ctypes
+import numpy as np
+import OpenGL
+
+OpenGL.ERROR_CHECKING = False
+from OpenGL.GL import *
+from texcache import extensions
+
+PIXEL_FORMATS = {1: GL_RED, 2: GL_RG, 3: GL_RGB, 4: GL_RGBA}
+PIXEL_TYPES = {
+    np.dtype(np.uint8): GL_UNSIGNED_BYTE,
+    np.dtype(np.uint16): GL_UNSIGNED_SHORT,
+    np.dtype(np.float32): GL_FLOAT,
+}
+
+
+def signaled(fence):
+    """Has the GPU passed fence? Never waits."""
+    return glClientWaitSync(fence, 0, 0) in (
+        GL_ALREADY_SIGNALED,
+        GL_CONDITION_SATISFIED,
+    )
+
+
+class TextureStreamer:
+    """Uploads texture data through a ring of pixel unpack buffers.
+
+    The CPU copy goes into a mapped buffer and glTexSubImage2D sources from
+    it, so the transfer to the texture happens asynchronously on the GPU.
+    Each slot is fenced after use. A slot whose fence has not passed yet is
+    orphaned rather than waited on, so an upload never blocks the frame.
+    """
+
+    def __init__(self, slots=3):
+        """Create streamer with slots buffers in flight."""
+        self.buffer_ids = [int(b) for b in np.atleast_1d(glGenBuffers(slots))]
+        self.sizes = [0] * slots
+        self.fences = [None] * slots
+        self.next_slot = 0
+        self.orphaned = 0
+
+    def release(self):
+        """Delete the fences and buffers, call while the context is current."""
+        for fence in self.fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        self.fences = [None] * len(self.fences)
+        if self.buffer_ids:
+            glDeleteBuffers(len(self.buffer_ids), self.buffer_ids)
+        self.buffer_ids = []
+
+    def _acquire(self, nbytes):
+        """Bind the next slot with room for nbytes that the GPU is done with."""
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % len(self.buffer_ids)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.buffer_ids[slot])
+        fence = self.fences[slot]
+        busy = fence is not None and not signaled(fence)
+        if fence is not None:
+            glDeleteSync(fence)
+            self.fences[slot] = None
+        if busy or self.sizes[slot] < nbytes:
+            # orphan, the driver hands out fresh storage instead of stalling
+            self.sizes[slot] = max(nbytes, self.sizes[slot])
+            glBufferData(GL_PIXEL_UNPACK_BUFFER, self.sizes[slot], None, GL_STREAM_DRAW)
+            self.orphaned += busy
+        return slot
+
+    def upload(self, target, pixels, x=0, y=0, level=0):
+        """Copy (H,W,C) pixels into the bound texture at x, y of level.
+
+        Rows are bottom first like everywhere else in GL.
+        """
+        pixels = np.ascontiguousarray(pixels)
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, np.newaxis]
+        height, width, channels = pixels.shape
+        slot = self._acquire(pixels.nbytes)
+        # the slot is unused or orphaned, so mapping it can skip the sync
+        ptr = glMapBufferRange(
+            GL_PIXEL_UNPACK_BUFFER,
+            0,
+            pixels.nbytes,
+            GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_RANGE_BIT | GL_MAP_UNSYNCHRONIZED_BIT,
+        )
+        ctypes.memmove(ptr, pixels.ctypes.data, pixels.nbytes)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+        glTexSubImage2D(
+            target,
+            level,
+            x,
+            y,
+            width,
+            height,
+            PIXEL_FORMATS[channels],
+            PIXEL_TYPES[pixels.dtype],
+            ctypes.c_void_p(0),
+        )
+        # unbind, other uploads read from client memory
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        self.fences[slot] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+
+class RingBuffer:
+    """Per-frame dynamic data in one buffer, split into frames in flight.
+
+    Every frame writes into its own region through a NumPy view and draws
+    reference the byte offsets alloc() returns. With buffer storage the
+    whole buffer is mapped once, persistently and coherently, so writes
+    land in GL memory with no copy and a region is reused once the fence
+    from frames in flight ago has passed. Without it the view is a staging
+    array, flush() uploads what the frame wrote and each frame orphans the
+    buffer instead of fencing.
+
+    A frame that outgrows its region doubles size until it fits, see
+    alloc(). Offsets handed out before keep pointing at the same data.
+    """
+
+    def __init__(self, target=GL_ARRAY_BUFFER, size=1 << 20, frames=3):
+        """Create ring with size bytes for each of frames frames in flight."""
+        self.target = target
+        self.size = size
+        self.frames = frames
+        self.persistent = "GL_ARB_buffer_storage" in extensions()
+        self.fences = [None] * frames
+        self.frame = 0
+        self.start = 0
+        self.cursor = 0
+        self.flushed = 0
+        self.stalls = 0
+        self.grown = False
+        self.buffer_id, self.view = self._create(size * frames)
+
+    def _create(self, nbytes):
+        """Make a buffer of nbytes, returns (buffer id, view)."""
+        buffer_id = int(glGenBuffers(1))
+        glBindBuffer(self.target, buffer_id)
+        if self.persistent:
+            flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+            glBufferStorage(self.target, nbytes, None, flags)
+            ptr = glMapBufferRange(self.target, 0, nbytes, flags)
+            view = np.ctypeslib.as_array((ctypes.c_ubyte * nbytes).from_address(ptr))
+        else:
+            glBufferData(self.target, nbytes, None, GL_STREAM_DRAW)
+            view = np.zeros(nbytes, dtype=np.uint8)
+        return buffer_id, view
+
+    def _delete(self):
+        """Unmap and delete the buffer, draws already issued still read it."""
+        # drop the view into the mapping before the mapping goes away
+        self.view = None
+        if self.persistent:
+            glBindBuffer(self.target, self.buffer_id)
+            glUnmapBuffer(self.target)
+        glDeleteBuffers(1, [self.buffer_id])
+        self.buffer_id = 0
+
+    def release(self):
+        """Unmap and delete the buffer, call while the context is current."""
+        if not self.buffer_id:
+            return
+        for fence in self.fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        self.fences = [None] * self.frames
+        self._delete()
+
+    def _grow(self, size):
+        """Move to a buffer with regions of size bytes.
+
+        The frame keeps its start, so its offsets stay valid, and its region
+        ends size bytes later. That overlaps the regions of the new layout,
+        the next begin_frame() waits for the frame before reusing any.
+        """
+        buffer_id, view = self._create(size * self.frames)
+        # the staging array also holds what was not flushed yet
+        end = self.cursor if self.persistent else self.flushed
+        if not self.persistent:
+            view[: self.cursor] = self.view[: self.cursor]
+        if end > self.start:
+            glBindBuffer(GL_COPY_READ_BUFFER, self.buffer_id)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, buffer_id)
+            glCopyBufferSubData(
+                GL_COPY_READ_BUFFER,
+                GL_COPY_WRITE_BUFFER,
+                self.start,
+                self.start,
+                end - self.start,
+            )
+        self._delete()
+        self.buffer_id = buffer_id
+        self.view = view
+        self.size = size
+        self.grown = True
+
+    def begin_frame(self):
+        """Move to the next region, waiting if the GPU still reads it."""
+        if self.grown:
+            # the last frame spilled over the regions of the new layout
+            for fence in self.fences:
+                if fence is not None:
+                    if not signaled(fence):
+                        self.stalls += 1
+                        glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000)
+                    glDeleteSync(fence)
+            self.fences = [None] * self.frames
+            self.grown = False
+        self.frame = (self.frame + 1) % self.frames
+        self.start = self.cursor = self.flushed = self.frame * self.size
+        fence = self.fences[self.frame]
+        if fence is not None:
+            if not signaled(fence):
+                self.stalls += 1
+                glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000)
+            glDeleteSync(fence)
+            self.fences[self.frame] = None
+        if not self.persistent:
+            glBindBuffer(self.target, self.buffer_id)
+            glBufferData(self.target, self.size * self.frames, None, GL_STREAM_DRAW)
+
+    def alloc(self, nbytes, align=16):
+        """Reserve nbytes of this frame's region, returns (view, byte offset).
+
+        When the region is full the ring grows into a new buffer, so write
+        views of earlier allocs before the next alloc, after it they point
+        at memory that is gone.
+        """
+        offset = self.cursor + (-self.cursor % align)
+        size = self.size
+        while offset + nbytes > self.start + size:
+            size *= 2
+        if size != self.size:
+            self._grow(size)
+        self.cursor = offset + nbytes
+        return self.view[offset : offset + nbytes], offset
+
+    def array(self, shape, dtype=np.float32):
+        """Reserve an array of this frame's region, returns (array, byte offset)."""
+        dtype = np.dtype(dtype)
+        view, offset = self.alloc(int(np.prod(shape)) * dtype.itemsize)
+        return view.view(dtype).reshape(shape), offset
+
+    def flush(self):
+        """Make everything written so far visible to draws."""
+        if self.persistent or self.cursor == self.flushed:
+            return
+        glBindBuffer(self.target, self.buffer_id)
+        glBufferSubData(
+            self.target,
+            self.flushed,
+            self.cursor - self.flushed,
+            self.view[self.flushed : self.cursor],
+        )
+        self.flushed = self.cursor
+
+    def end_frame(self):
+        """Fence this frame's region, call after its last draw."""
+        if self.persistent:
+            self.fences[self.frame] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
@@ -0,0 +1,210 @@
+"""Texture baking and on-disk caching."""
+
+import json
+import os
+import numpy as np
+from PIL import Image
+import OpenGL
+
+OpenGL.ERROR_CHECKING = False
+from OpenGL.GL import *
+from OpenGL.raw.GL.EXT.texture_compression_s3tc import *
+
+# the wrapped glGetCompressedTexImage always reads back level 0
+from OpenGL.raw.GL.VERSION.GL_1_3 import glGetCompressedTexImage
+
+CACHE_DIR = os.path.join(".cache", "textures")
+CACHE_VERSION = 1
+
+
+class Level:
+    """One mip level of one face inside a baked texture blob."""
+
+    def __init__(self, face, level, width, height, offset, size):
+        """Create level."""
+        self.face = face
+        self.level = level
+        self.width = width
+        self.height = height
+        self.offset = offset
+        self.size = size
+
+
+def extensions():
+    """Names of the extensions the current context supports."""
+    count = glGetIntegerv(GL_NUM_EXTENSIONS)
+    return set(glGetStringi(GL_EXTENSIONS, i).decode() for i in range(count))
+
+
+def compressed_format(alpha=True):
+    """Best compressed internal format the driver can encode, or None."""
+    supported = extensions()
+    if "GL_ARB_texture_compression_bptc" in supported:
+        return int(GL_COMPRESSED_RGBA_BPTC_UNORM)
+    if "GL_EXT_texture_compression_s3tc" in supported:
+        if alpha:
+            return int(GL_COMPRESSED_RGBA_S3TC_DXT5_EXT)
+        return int(GL_COMPRESSED_RGB_S3TC_DXT1_EXT)
+    return None
+
+
+def _source_key(paths, internal_format):
+    """Identify sources by path, size and mtime so warm starts never read them."""
+    key = [CACHE_VERSION, internal_format]
+    for path in paths:
+        stat = os.stat(path)
+        key.append([path, stat.st_size, stat.st_mtime_ns])
+    return key
+
+
+def _cache_paths(name):
+    base = os.path.join(CACHE_DIR, name.strip("/").replace("/", "_"))
+    return base + ".json", base + ".bin"
+
+
+def decode(path):
+    """Decode an image into bottom row first RGBA levels down to 1x1.
+
+    Returns (width, height, bytes) per level. Only touches PIL, which
+    releases the GIL while decoding and resizing, so it can run on a
+    worker thread.
+    """
+    im = Image.open(path).convert("RGBA")
+    levels = [(im.width, im.height, im.tobytes("raw", "RGBA", 0, -1))]
+    while im.width > 1 or im.height > 1:
+        im = im.resize((max(im.width // 2, 1), max(im.height // 2, 1)), Image.BOX)
+        levels.append((im.width, im.height, im.tobytes("raw", "RGBA", 0, -1)))
+    return levels
+
+
+def _read_cache(name, key):
+    """Memory-map a baked texture, or return None if it is missing or stale."""
+    header_path, blob_path = _cache_paths(name)
+    try:
+        with open(header_path, "r") as src:
+            header = json.load(src)
+        if header["key"] != key:
+            return None
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        levels = [Level(**level) for level in header["levels"]]
+        return header["internal_format"], header["compressed"], levels, blob
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_cache(name, key, internal_format, compressed, levels, data):
+    """Store every level as one raw blob plus a JSON header describing it."""
+    header_path, blob_path = _cache_paths(name)
+    header = {
+        "key": key,
+        "internal_format": internal_format,
+        "compressed": compressed,
+        "levels": [vars(level) for level in levels],
+    }
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(blob_path + ".tmp", "wb") as out:
+            for chunk in data:
+                out.write(chunk)
+        with open(header_path + ".tmp", "w") as out:
+            json.dump(header, out)
+        os.replace(blob_path + ".tmp", blob_path)
+        os.replace(header_path + ".tmp", header_path)
+    except OSError as e:
+        print(f"Warning: could not write texture cache for {name}: {e}")
+
+
+def _upload(targets, internal_format, compressed, levels, blob):
+    """Stream every cached level into the bound texture."""
+    for level in levels:
+        data = blob[level.offset : level.offset + level.size]
+        if compressed:
+            glCompressedTexImage2D(
+                targets[level.face],
+                level.level,
+                internal_format,
+                level.width,
+                level.height,
+                0,
+                data,
+            )
+        else:
+            glTexImage2D(
+                targets[level.face],
+                level.level,
+                internal_format,
+                level.width,
+                level.height,
+                0,
+                GL_RGBA,
+                GL_UNSIGNED_BYTE,
+                data,
+            )
+
+
+def _bake(targets, chains, internal_format):
+    """Upload decoded mip chains, reading back what the driver stored.
+
+    When internal_format is compressed the driver does the encoding and the
+    compressed levels are read back for the cache.
+    """
+    compressed = False
+    levels = []
+    data = []
+    offset = 0
+    for face, (target, chain) in enumerate(zip(targets, chains)):
+        for i, (width, height, pixels) in enumerate(chain):
+            glTexImage2D(
+                target,
+                i,
+                internal_format,
+                width,
+                height,
+                0,
+                GL_RGBA,
+                GL_UNSIGNED_BYTE,
+                pixels,
+            )
+            compressed = bool(
+                glGetTexLevelParameteriv(target, i, GL_TEXTURE_COMPRESSED)
+            )
+            if compressed:
+                size = glGetTexLevelParameteriv(
+                    target, i, GL_TEXTURE_COMPRESSED_IMAGE_SIZE
+                )
+                pixels = np.empty(size, dtype=np.uint8)
+                glGetCompressedTexImage(target, i, pixels)
+                pixels = pixels.tobytes()
+            levels.append(Level(face, i, width, height, offset, len(pixels)))
+            # keep every level 16 byte aligned within the blob
+            pixels += b"\0" * (-len(pixels) % 16)
+            data.append(pixels)
+            offset += len(pixels)
+    return compressed, levels, data
+
+
+def is_cached(paths, name, internal_format):
+    """Is there a fresh bake of paths?."""
+    return _read_cache(name, _source_key(paths, internal_format)) is not None
+
+
+def load(target, paths, name, internal_format, face_targets=None, chains=None):
+    """Fill the bound texture with baked, mipmapped levels of paths.
+
+    Textures are baked on first use into .cache/textures, later loads
+    memory-map the bake and skip decoding. face_targets lists the upload
+    target of each path, for cubemaps. chains are the already decoded
+    levels of each path, they are decoded here when needed if None.
+    Returns the number of mip levels.
+    """
+    targets = face_targets or [target]
+    key = _source_key(paths, internal_format)
+    cached = None if chains else _read_cache(name, key)
+    if cached:
+        cached_format, compressed, levels, blob = cached
+        _upload(targets, cached_format, compressed, levels, blob)
+    else:
+        chains = chains or [decode(path) for path in paths]
+        compressed, levels, data = _bake(targets, chains, internal_format)
+        _write_cache(name, key, internal_format, compressed, levels, data)
+    return max(level.level for level in levels) + 1
@@ -1,109 +1,219 @@
 """Text."""
 
 import OpenGL
+import numpy as np
 from entity import DrawableEntity
+from renderqueue import OVERLAY, view_depth
 from PIL import Image, ImageFont, ImageDraw
 import math
+import vertexformat
 
 OpenGL.ERROR_CHECKING = False
 from OpenGL.GL import *
-from OpenGL.raw.GL.EXT.texture_filter_anisotropic import *
+
+
+def _advance(font, text):
+    """Horizontal advance of text, for both old and new Pillow."""
+    if hasattr(font, "getlength"):
+        return font.getlength(text)
+    return font.getsize(text)[0]
+
+
+class GlyphAtlas:
+    """Printable ASCII of a font rasterized once into a single texture."""
+
+    FIRST = 32
+    LAST = 126
+    PADDING = 4
+
+    def __init__(self, ctx, font_name, size=72):
+        """Rasterize the font and upload the atlas."""
+        font = ImageFont.truetype(f"assets/{font_name}.otf", size=size)
+        count = self.LAST - self.FIRST + 1
+        # per glyph: advance, offset box relative to the pen and atlas box
+        self.advance = np.zeros(count, dtype=np.float32)
+        self.offset = np.zeros((count, 4), dtype=np.float32)
+        self.uv = np.zeros((count, 4), dtype=np.float32)
+
+        glyphs = []
+        cell = Image.new("RGBA", (size * 3, size * 3), (0, 0, 0, 0))
+        cell_draw = ImageDraw.Draw(cell)
+        for i in range(count):
+            ch = chr(self.FIRST + i)
+            self.advance[i] = _advance(font, ch)
+            cell_draw.rectangle([0, 0, cell.width, cell.height], (0, 0, 0, 0))
+            cell_draw.text((size, size), ch, (255, 255, 255, 255), font)
+            bbox = cell.getchannel("A").getbbox()
+            if bbox:
+                self.offset[i] = [
+                    bbox[0] - size,
+                    bbox[1] - size,
+                    bbox[2] - size,
+                    bbox[3] - size,
+                ]
+                glyphs.append((i, cell.crop(bbox)))
+        # lines are spaced the way ImageDraw.multiline_text spaces them
+        a = ord("A") - self.FIRST
+        self.line_spacing = self.offset[a, 3] + 4
+
+        # shelf pack the glyphs into rows
+        width = 1024
+        x = y = row_height = 0
+        placements = []
+        for i, im in glyphs:
+            if x + im.width + self.PADDING > width:
+                x = 0
+                y += row_height + self.PADDING
+                row_height = 0
+            placements.append((i, im, x, y))
+            x += im.width + self.PADDING
+            row_height = max(row_height, im.height)
+        height = 1 << int(math.ceil(math.log2(y + row_height + 1)))
+        atlas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        for i, im, x, y in placements:
+            atlas.paste(im, (x, y))
+            # the texture is uploaded bottom row first
+            self.uv[i] = [
+                x / width,
+                1 - y / height,
+                (x + im.width) / width,
+                1 - (y + im.height) / height,
+            ]
+        self.texture_id = ctx.create_texture(atlas)
+
+    def layout(self, text, origin, align="center"):
+        """Glyph quads of text as (N,4) pixel boxes and (N,4) uv boxes.
+
+        Pixel coordinates grow right and down from origin like PIL's.
+        """
+        lines = text.split("\n")
+        codes = [
+            np.clip(
+                np.frombuffer(line.encode("ascii", "replace"), dtype=np.uint8),
+                self.FIRST,
+                self.LAST,
+            ).astype(np.intp)
+            - self.FIRST
+            for line in lines
+        ]
+        widths = [self.advance[c].sum() for c in codes]
+        max_width = max(widths)
+        boxes = []
+        uvs = []
+        for i, c in enumerate(codes):
+            left = origin[0]
+            if align == "center":
+                left += (max_width - widths[i]) / 2.0
+            elif align == "right":
+                left += max_width - widths[i]
+            pen_x = left + np.cumsum(self.advance[c]) - self.advance[c]
+            pen_y = np.full_like(pen_x, origin[1] + i * self.line_spacing)
+            box = self.offset[c] + np.stack([pen_x, pen_y, pen_x, pen_y], axis=1)
+            visible = self.offset[c, 2] > self.offset[c, 0]
+            boxes.append(box[visible])
+            uvs.append(self.uv[c][visible])
+        return np.concatenate(boxes), np.concatenate(uvs)
 
 
 class Text(DrawableEntity):
     """Arbitrary text that may be position in 3d."""
 
+    atlases = {}
+    # text is laid out on a square canvas of this many pixels that spans
+    # the unit plane the text is drawn on
+    CANVAS = 512.0
+    ORIGIN = (0, 196)
+
     def __init__(
         self, ctx, pos, text, font_name="futura", default_color=(255, 255, 255, 255)
     ):
         """Create entity."""
         super().__init__("plane", pos, [0, math.pi / 2, -math.pi / 2])
-        self.text = text
-
-        self.image = Image.new("RGBA", (512, 512), (0, 0, 0, 0))
+        self.text = None
         self.color = default_color
-
-        self.font = ImageFont.truetype(f"assets/{font_name}.otf", size=72)
-        self.image_draw = ImageDraw.Draw(self.image)
-        self.image_draw.text((0, 196), text, self.color, self.font, align="center")
-
-        data = self.image.tobytes("raw", "RGBA", 0, -1)
-
-        # generate a new texture id
-        texture_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, texture_id)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
-
-        max_af = min(glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT), 16.0)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, max_af)
-        # upload texture
-        glTexImage2D(
-            GL_TEXTURE_2D,
-            0,
-            GL_RGBA,
-            self.image.width,
-            self.image.height,
-            0,
-            GL_RGBA,
-            GL_UNSIGNED_BYTE,
-            data,
-        )
-        glGenerateMipmap(GL_TEXTURE_2D)
-        self.texture_id = texture_id
+        self.tint = np.array(default_color, dtype=np.float32) / 255.0
+        if font_name not in self.atlases:
+            self.atlases[font_name] = GlyphAtlas(ctx, font_name)
+        self.atlas = self.atlases[font_name]
+        ctx.create_program("text")
+
+        self.ctx = ctx
+        self.vao = f"text{id(self)}"
+        ctx.create_vao(self.vao, vertexformat.FLOAT)
+        ctx.use_vao(self.vao)
+        vao = ctx.vertex_arrays[self.vao]
+        self.vbo, self.ibo = glGenBuffers(2)
+        vao.buffer_ids += [self.vbo, self.ibo]
+        self.capacity = 0
+        self.glyphs = 0
+        self.update(text)
 
     def __del__(self):
-        glDeleteTextures(self.texture_id)
+        self.ctx.delete_vao(self.vao)
 
-    def draw(self, ctx, camera):
+    def _reserve(self, glyphs):
+        """Grow the vertex and index buffers to hold glyphs quads."""
+        if glyphs <= self.capacity:
+            return
+        self.capacity = max(glyphs, self.capacity * 2, 32)
+        self.vertices = np.zeros((self.capacity, 4, 8), dtype=np.float32)
+        # every vertex faces +x like the plane model
+        self.vertices[:, :, 2] = 1.0
+        quad = np.array([0, 2, 1, 1, 2, 3], dtype=np.uint16)
+        indices = quad + 4 * np.arange(self.capacity, dtype=np.uint16)[:, np.newaxis]
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ibo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        vertexformat.FLOAT.bind()
+
+    def draw(self, queue, camera):
+        """Queue da thing on the overlay layer."""
+        if not self.glyphs:
+            return
+        super()._update_transform()
+        queue.submit(
+            self.render,
+            OVERLAY,
+            "text",
+            self.atlas.texture_id,
+            self.vao,
+            view_depth(camera, self.pos),
+        )
+
+    def render(self, ctx, camera):
         """Draw da thing."""
-        glDisable(GL_DEPTH_TEST)
+        ctx.disable(GL_DEPTH_TEST)
+        ctx.use_vao(self.vao)
         ctx.use_program("text")
-        super()._update_transform()
-        camera_uniforms = camera.gen_uniforms(self.transform)
-        model = ctx.get_model(self.model)
-        ctx.update_uniforms(camera_uniforms)
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.texture_id)
-        glDrawArrays(GL_TRIANGLES, model.offset, model.indices)
-        glEnable(GL_DEPTH_TEST)
+        ctx.update_uniforms({"M": self.transform, "tint": self.tint})
+        ctx.bind_texture(GL_TEXTURE_2D, self.atlas.texture_id)
+        glDrawElements(GL_TRIANGLES, self.glyphs * 6, GL_UNSIGNED_SHORT, None)
 
     def update(self, text, color=None):
         """Update."""
-        if self.text == text and not color:
+        if color:
+            self.tint = np.array(color, dtype=np.float32) / 255.0
+        elif self.text != text:
+            self.tint = np.array(self.color, dtype=np.float32) / 255.0
+        if self.text == text:
             return
         self.text = text
-        glDeleteTextures(self.texture_id)
-        self.image_draw.rectangle([0, 0, 512, 512], (0, 0, 0, 0))
-        self.image_draw.text(
-            (0, 196), text, color or self.color, self.font, align="center"
-        )
-
-        data = self.image.tobytes("raw", "RGBA", 0, -1)
-
-        # generate a new texture id
-        texture_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, texture_id)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
-
-        max_af = min(glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT), 16.0)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, max_af)
-        # upload texture
-        glTexImage2D(
-            GL_TEXTURE_2D,
-            0,
-            GL_RGBA,
-            self.image.width,
-            self.image.height,
-            0,
-            GL_RGBA,
-            GL_UNSIGNED_BYTE,
-            data,
-        )
-        glGenerateMipmap(GL_TEXTURE_2D)
-        self.texture_id = texture_id
+        boxes, uvs = self.atlas.layout(text, self.ORIGIN)
+        self.glyphs = len(boxes)
+        if not self.glyphs:
+            return
+        self.ctx.use_vao(self.vao)
+        self._reserve(self.glyphs)
+        quads = self.vertices[: self.glyphs]
+        # corners in order top left, top right, bottom left, bottom right
+        for corner, (x, y) in enumerate([(0, 1), (2, 1), (0, 3), (2, 3)]):
+            quads[:, corner, 0] = uvs[:, x]
+            quads[:, corner, 1] = uvs[:, y]
+            # canvas pixels to the plane's local y/z
+            quads[:, corner, 6] = 0.5 - boxes[:, x] / self.CANVAS
+            quads[:, corner, 7] = boxes[:, y] / self.CANVAS - 0.5
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, quads.nbytes, quads)
+        self.ctx.bytes_uploaded += quads.nbytes
@@ -0,0 +1,37 @@
+"""Batched transform math.
+
+Matrices follow the pyrr convention used everywhere else: row vectors, so a
+model matrix is rotation then translation and MVP is M . V . P.
+"""
+
+import numpy as np
+
+
+def model_matrices(pos, rot, out=None):
+    """Build (N,4,4) model matrices from (N,3) positions and pyrr eulers.
+
+    Equivalent to matrix44.create_from_eulers(rot) . create_from_translation(pos)
+    for every row, eulers are (roll, pitch, yaw).
+    """
+    n = len(pos)
+    if out is None:
+        out = np.empty((n, 4, 4), dtype=np.float32)
+    s = np.sin(rot)
+    c = np.cos(rot)
+    sR, sP, sY = s[:, 0], s[:, 1], s[:, 2]
+    cR, cP, cY = c[:, 0], c[:, 1], c[:, 2]
+    sYsP = sY * sP
+    cYsP = cY * sP
+    out[:, 0, 0] = cY * cP
+    out[:, 0, 1] = sY * sR - cYsP * cR
+    out[:, 0, 2] = cYsP * sR + sY * cR
+    out[:, 1, 0] = sP
+    out[:, 1, 1] = cP * cR
+    out[:, 1, 2] = -cP * sR
+    out[:, 2, 0] = -sY * cP
+    out[:, 2, 1] = sYsP * cR + cY * sR
+    out[:, 2, 2] = cY * cR - sYsP * sR
+    out[:, :3, 3] = 0.0
+    out[:, 3, :3] = pos
+    out[:, 3, 3] = 1.0
+    return out
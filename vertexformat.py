@@ -0,0 +1,176 @@
+"""Vertex layouts of model buffers.
+
+Meshes are built as float32 rows of uv (2), normal (3) and position (3).
+A vertex format turns those rows into what is stored in the vertex buffer
+and describes the attribute pointers that read them back.
+"""
+
+import ctypes
+import numpy as np
+import OpenGL
+
+OpenGL.ERROR_CHECKING = False
+from OpenGL.GL import *
+
+# largest error decoding may add, positions relative to the model scale
+TOLERANCES = {"uv": 1e-4, "normal": 2e-3, "position": 1e-4}
+
+
+class Attribute:
+    """One vertex attribute pointer."""
+
+    def __init__(self, location, size, type, normalized, offset):
+        """Create attribute."""
+        self.location = location
+        self.size = size
+        self.type = type
+        self.normalized = normalized
+        self.offset = offset
+
+
+class VertexFormat:
+    """Float32 vertices, stored exactly as meshes are built."""
+
+    stride = 32
+    lossy = False
+    attributes = [
+        Attribute(0, 2, GL_FLOAT, GL_FALSE, 0),
+        Attribute(1, 3, GL_FLOAT, GL_FALSE, 8),
+        Attribute(2, 3, GL_FLOAT, GL_FALSE, 20),
+    ]
+
+    def bind(self):
+        """Point the attributes at the bound array buffer."""
+        for attribute in self.attributes:
+            glEnableVertexAttribArray(attribute.location)
+            glVertexAttribPointer(
+                attribute.location,
+                attribute.size,
+                attribute.type,
+                attribute.normalized,
+                self.stride,
+                ctypes.c_void_p(attribute.offset),
+            )
+
+    def encode(self, vertices):
+        """Buffer contents for (N,8) vertices, returns (data, position scale).
+
+        Positions come back multiplied by position scale, the model matrix
+        has to scale them back.
+        """
+        return vertices, 1.0
+
+    def decode(self, data, scale):
+        """Float32 (N,8) vertices the shaders see for encoded data."""
+        return np.asarray(data, dtype=np.float32)
+
+    def errors(self, vertices, data, scale):
+        """Largest error of every attribute after an encode, by name."""
+        decoded = self.decode(data, scale)
+        error = np.abs(decoded - vertices).max(axis=0, initial=0.0)
+        return {
+            "uv": float(error[0:2].max()),
+            "normal": float(error[2:5].max()),
+            "position": float(error[5:8].max()) / scale,
+        }
+
+    def validate(self, name, vertices, data, scale):
+        """Warn and return False when encoding lost more than TOLERANCES allow."""
+        valid = True
+        for attribute, error in self.errors(vertices, data, scale).items():
+            if error > TOLERANCES[attribute]:
+                print(
+                    f"Warning: model {name}: {attribute} error {error:.2g} is over"
+                    + f" {TOLERANCES[attribute]:.2g} in {type(self).__name__}"
+                )
+                valid = False
+        return valid
+
+
+class PackedVertexFormat(VertexFormat):
+    """16 bytes per vertex, half of float32.
+
+    uvs are unorm16, uvs outside [0, 1] are clamped and fail validate().
+    Normals are snorm10 packed as GL_INT_2_10_10_10_REV. Positions are
+    snorm16 divided by the largest coordinate of the model. The scale is the
+    same on every axis and keeps the origin in place, so it folds into the
+    model matrix without touching normals, bounds or the direction skybox
+    lookups use.
+
+    Before GL 4.2 a snorm c of b bits reads as (2c + 1) / (2^b - 1), which
+    cannot hold 0, since then as max(c / (2^(b-1) - 1), -1). legacy_snorm
+    encodes and decodes with the older rule, see packed_format().
+    """
+
+    stride = 16
+    lossy = True
+    dtype = np.dtype(
+        {
+            "names": ["uv", "normal", "position"],
+            "formats": [(np.uint16, 2), np.uint32, (np.int16, 3)],
+            "offsets": [0, 4, 8],
+            "itemsize": 16,
+        }
+    )
+    attributes = [
+        Attribute(0, 2, GL_UNSIGNED_SHORT, GL_TRUE, 0),
+        Attribute(1, 4, GL_INT_2_10_10_10_REV, GL_TRUE, 4),
+        Attribute(2, 3, GL_SHORT, GL_TRUE, 8),
+    ]
+
+    def __init__(self, legacy_snorm=False):
+        """Create format, legacy_snorm for contexts older than GL 4.2."""
+        self.legacy_snorm = legacy_snorm
+
+    def _snorm(self, values, bits):
+        """Nearest snorm of bits bits of values in [-1, 1], as int32."""
+        high = (1 << bits - 1) - 1
+        if self.legacy_snorm:
+            values = (values * (2 * high + 1) - 1) / 2
+        else:
+            values = values * high
+        return np.clip(np.rint(values), -high - 1, high).astype(np.int32)
+
+    def _float(self, values, bits):
+        """Float32 the shaders read for snorm values of bits bits."""
+        high = (1 << bits - 1) - 1
+        if self.legacy_snorm:
+            return ((2 * values + 1) / (2 * high + 1)).astype(np.float32)
+        return np.maximum(values / high, -1.0).astype(np.float32)
+
+    def encode(self, vertices):
+        """Buffer contents for (N,8) vertices, returns (data, position scale)."""
+        data = np.zeros(len(vertices), dtype=self.dtype)
+        data["uv"] = np.rint(np.clip(vertices[:, 0:2], 0.0, 1.0) * 65535)
+        normal = self._snorm(np.clip(vertices[:, 2:5], -1.0, 1.0), 10)
+        normal &= 0x3FF
+        data["normal"] = normal[:, 0] | normal[:, 1] << 10 | normal[:, 2] << 20
+        scale = float(np.abs(vertices[:, 5:8]).max(initial=0.0)) or 1.0
+        data["position"] = self._snorm(vertices[:, 5:8] / scale, 16)
+        return data.view(np.uint8).reshape(-1, self.stride), scale
+
+    def decode(self, data, scale):
+        """Float32 (N,8) vertices the shaders see for encoded data."""
+        data = data.reshape(-1).view(self.dtype)
+        vertices = np.empty((len(data), 8), dtype=np.float32)
+        vertices[:, 0:2] = data["uv"] / 65535
+        shifts = np.array([0, 10, 20], dtype=np.uint32)
+        normal = (data["normal"][:, np.newaxis] >> shifts & 0x3FF).astype(np.int32)
+        # sign extend the 10 bit fields
+        normal -= (normal & 0x200) << 1
+        vertices[:, 2:5] = self._float(normal, 10)
+        position = self._float(data["position"].astype(np.int32), 16)
+        # back in model units, like the model matrix scales them
+        vertices[:, 5:8] = position * scale
+        return vertices
+
+
+FLOAT = VertexFormat()
+PACKED = PackedVertexFormat()
+PACKED_LEGACY = PackedVertexFormat(legacy_snorm=True)
+
+
+def packed_format():
+    """PACKED or PACKED_LEGACY, whichever rule the current context reads."""
+    version = (glGetIntegerv(GL_MAJOR_VERSION), glGetIntegerv(GL_MINOR_VERSION))
+    return PACKED if version >= (4, 2) else PACKED_LEGACY
@@ -47,6 +47,10 @@ class Window:
         else:
             self.keys[key] = False
 
+    def time(self):
+        """Seconds since glfw was initialized."""
+        return glfw.get_time()
+
     def key(self, k):
         """Query keypress."""
         return self.keys.get(k, False)